@@ -0,0 +1,63 @@
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import pytest
+
+# Set before any bot module reads config. The local mail transport keeps Mailgun out of it.
+os.environ.setdefault("DISCORD_TOKEN", "benchmark")
+os.environ.setdefault("ALLOWED_EMAIL_DOMAINS", "unsw.edu.au,student.unsw.edu.au,ad.unsw.edu.au")
+os.environ["MAIL_TRANSPORTS"] = "local"
+
+import config
+import utils
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+@dataclass(frozen=True)
+class FakeGuild:
+    """The parts of discord.Guild that the database helpers use."""
+
+    id: int
+    name: str = "Benchmark Server"
+
+
+@pytest.fixture(autouse=True)
+def db_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_DIR", str(tmp_path))
+    yield tmp_path
+    for guild_id in list(utils._guild_dbs):
+        utils.close_guild_db(guild_id)
+
+
+@pytest.fixture
+def guild() -> FakeGuild:
+    return FakeGuild(1)
+
+
+def fill_users(conn: sqlite3.Connection, rows: int) -> None:
+    """Adds `rows` synthetic members, most of them verified."""
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (discord_id, email, verified, verified_at) VALUES (?, ?, ?, ?)",
+            (
+                (
+                    100000000000000000 + i,
+                    f"z{5000000 + i}@ad.unsw.edu.au",
+                    int(i % 10 != 0),
+                    1700000000 + i if i % 10 != 0 else None,
+                )
+                for i in range(rows)
+            ),
+        )
+
+
+@pytest.fixture(params=[1_000, 100_000], ids=lambda rows: f"{rows}_rows")
+def guild_db(request) -> sqlite3.Connection:
+    """A guild database filled with synthetic members."""
+    conn = utils.open_guild_db(FakeGuild(request.param))  # type: ignore
+    fill_users(conn, request.param)
+    yield conn
+    conn.close()
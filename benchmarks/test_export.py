@@ -0,0 +1,40 @@
+import os
+import time
+
+import pytest
+
+from export import export_db_snapshot, export_db_to_csv, import_csv_to_db, import_snapshot
+from maintenance import maintain_db
+
+pytestmark = pytest.mark.benchmark(group="export")
+
+
+def _rounds(conn) -> int:
+    # The 100k row runs take around a second each
+    return 3 if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] > 10_000 else 20
+
+
+def test_export_db_to_csv(benchmark, guild_db):
+    benchmark.pedantic(export_db_to_csv, args=(guild_db,), rounds=_rounds(guild_db))
+
+
+def test_import_csv_to_db(benchmark, guild_db):
+    csv_contents = export_db_to_csv(guild_db).getvalue().decode()
+
+    success, message = benchmark.pedantic(
+        import_csv_to_db, args=(guild_db, csv_contents), rounds=_rounds(guild_db)
+    )
+    assert success, message
+
+
+def test_snapshot_round_trip(benchmark, guild_db, tmp_path):
+    # Maintenance runs on every database daily, and adds ANALYZE's sqlite_stat1 table
+    ((_, _, db_path),) = guild_db.execute("PRAGMA database_list").fetchall()
+    maintain_db(os.path.dirname(db_path), time.monotonic() + 60)
+    dest_path = str(tmp_path / "import.db")
+
+    def round_trip():
+        return import_snapshot(export_db_snapshot(db_path).getvalue(), dest_path)
+
+    success, message = benchmark.pedantic(round_trip, rounds=_rounds(guild_db))
+    assert success, message
@@ -0,0 +1,40 @@
+import pytest
+
+from domains import DEFAULT_POLICY, DomainPolicy
+from otp import generate_otp, match_email, redact_email, valid_email_domain
+
+pytestmark = pytest.mark.benchmark(group="otp")
+
+
+@pytest.mark.parametrize(
+    "email", ["z5555555@ad.unsw.edu.au", "not an email"], ids=["valid", "invalid"]
+)
+def test_match_email(benchmark, email):
+    benchmark(match_email, email)
+
+
+@pytest.mark.parametrize(
+    "email", ["z5555555@ad.unsw.edu.au", "someone@gmail.com"], ids=["allowed", "rejected"]
+)
+def test_valid_email_domain(benchmark, email):
+    benchmark(valid_email_domain, email, DEFAULT_POLICY)
+
+
+@pytest.mark.parametrize(
+    "email", ["z5555555@ad.unsw.edu.au", "someone@gmail.com"], ids=["allowed", "rejected"]
+)
+def test_valid_email_domain_large_policy(benchmark, email):
+    # Should take about as long as with the default policy
+    policy = DomainPolicy(
+        ["*.unsw.edu.au", *(f"school{i}.edu.au" for i in range(10_000))],
+        [f"*.alumni{i}.unsw.edu.au" for i in range(1_000)],
+    )
+    benchmark(valid_email_domain, email, policy)
+
+
+def test_generate_otp(benchmark):
+    benchmark(generate_otp)
+
+
+def test_redact_email(benchmark):
+    benchmark(redact_email, "z5555555@ad.unsw.edu.au")
@@ -0,0 +1,39 @@
+import discord
+import pytest
+from discord import app_commands
+
+import utils
+
+pytestmark = pytest.mark.benchmark(group="utils")
+
+
+def _command_tree() -> app_commands.CommandTree:
+    # About the size of the bot's own command tree
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.none()))
+    for i in range(12):
+
+        async def callback(interaction: discord.Interaction, member: discord.Member, days: int = 7):
+            pass
+
+        tree.add_command(
+            app_commands.Command(name=f"command-{i}", description="A command", callback=callback)
+        )
+    return tree
+
+
+def test_get_commands_hash(benchmark):
+    benchmark(utils.get_commands_hash, _command_tree())
+
+
+def test_get_guild_db_hit(benchmark, guild):
+    utils.get_guild_db(guild)  # type: ignore
+    benchmark(utils.get_guild_db, guild)
+
+
+def test_get_guild_db_miss(benchmark, guild):
+    def evict():
+        utils.close_guild_db(guild.id)
+        return (guild,), {}
+
+    utils.get_guild_db(guild)  # type: ignore
+    benchmark.pedantic(utils.get_guild_db, setup=evict, rounds=200)
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import TYPE_CHECKING
+
+import config
+from utils import get_guild_db, start_background_task
+
+if TYPE_CHECKING:
+    import discord
+
+# Audit events
+OTP_SENT = "otp_sent"
+OTP_FAILED = "otp_failed"
+OTP_THROTTLED = "otp_throttled"
+DOMAIN_REJECTED = "domain_rejected"
+WRONG_CODE = "wrong_code"
+EXPIRED = "expired"
+VERIFIED = "verified"
+ROLE_RESTORED = "role_restored"
+EXPORTED = "exported"
+IMPORTED = "imported"
+IMPORT_FAILED = "import_failed"
+VERIFIED_ROLE_SET = "verified_role_set"
+DOMAIN_POLICY_SET = "domain_policy_set"
+
+# Dropped after config.AUDIT_COMPACT_DAYS. Their totals are kept in the stats table, except for
+# domain rejections: the domain is whatever was typed, so counting each one forever would let
+# anyone grow the table. Those are simply dropped.
+NOISY_EVENTS = (OTP_SENT, OTP_FAILED, OTP_THROTTLED, DOMAIN_REJECTED, WRONG_CODE, EXPIRED)
+
+PRUNE_INTERVAL_SECONDS = 24 * 60 * 60
+
+# Longer details are cut short, so a full page of /audit fits in one Discord message
+MAX_DETAIL_LENGTH = 50
+
+# Events waiting to be written: (guild, (created_at, event, discord_id, detail))
+_buffer: list[tuple[discord.Guild, tuple]] = []
+# guild_id -> time the guild's audit log was last pruned
+_pruned_at: dict[int, float] = {}
+
+
+def start() -> None:
+    """Starts periodically flushing buffered events. Must be called from the event loop."""
+    start_background_task("audit-flush", _flush_loop)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(config.AUDIT_FLUSH_MS / 1000)
+        try:
+            flush()
+        except Exception:
+            logging.exception("Failed to flush audit events")
+
+
+def record(
+    guild: discord.Guild,
+    event: str,
+    member: discord.abc.User | None = None,
+    detail: str | None = None,
+) -> None:
+    """Queues an audit event. It is written on the next flush."""
+    if detail is not None and len(detail) > MAX_DETAIL_LENGTH:
+        detail = detail[: MAX_DETAIL_LENGTH - 1] + "…"
+    _buffer.append((guild, (int(time.time()), event, member and member.id, detail)))
+
+    if len(_buffer) >= config.AUDIT_BATCH_SIZE:
+        flush()
+
+
+def flush() -> None:
+    """Writes all buffered events, in one transaction per guild.
+
+    A guild whose events can't be written doesn't stop the others. Its events are logged
+    instead, so they aren't lost.
+    """
+    if not _buffer:
+        return
+
+    guilds = {}
+    rows = {}
+    for guild, row in _buffer:
+        guilds[guild.id] = guild
+        rows.setdefault(guild.id, []).append(row)
+    _buffer.clear()
+
+    now = time.time()
+    for guild_id, guild_rows in rows.items():
+        try:
+            conn = get_guild_db(guilds[guild_id])
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO audit_log (created_at, event, discord_id, detail)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    guild_rows,
+                )
+        except Exception:
+            logging.exception(
+                f"Failed to write {len(guild_rows)} audit events for {guild_id}: {guild_rows}"
+            )
+            continue
+
+        if now - _pruned_at.get(guild_id, 0) > PRUNE_INTERVAL_SECONDS:
+            _pruned_at[guild_id] = now
+            try:
+                prune(conn)
+            except sqlite3.Error:
+                logging.exception(f"Failed to prune audit log for {guild_id}")
+
+
+def forget_guild(guild_id: int) -> None:
+    """Drops the state kept for a guild, e.g. when it is hibernated."""
+    _pruned_at.pop(guild_id, None)
+
+
+def prune(conn: sqlite3.Connection) -> int:
+    """Applies the retention policy to a guild's audit log. Returns the number of rows deleted."""
+    now = int(time.time())
+    compact_before = now - config.AUDIT_COMPACT_DAYS * 24 * 60 * 60
+    retain_after = now - config.AUDIT_RETENTION_DAYS * 24 * 60 * 60
+
+    with conn:
+        c = conn.cursor()
+        c.execute(
+            f"""
+            DELETE FROM audit_log
+            WHERE created_at < ? AND event IN ({", ".join("?" * len(NOISY_EVENTS))})
+        """,
+            (compact_before, *NOISY_EVENTS),
+        )
+        deleted = c.rowcount
+        c.execute("DELETE FROM audit_log WHERE created_at < ?", (retain_after,))
+        deleted += c.rowcount
+
+    if deleted:
+        logging.info(f"Pruned {deleted} old audit log entries")
+    return deleted
+
+
+def query(
+    guild: discord.Guild,
+    event: str | None = None,
+    discord_id: int | None = None,
+    before_id: int | None = None,
+    limit: int = config.AUDIT_PAGE_SIZE,
+) -> list[tuple[int, int, str, int | None, str | None]]:
+    """Returns up to `limit` audit entries, newest first.
+
+    Pages are keyed on the entry id rather than an offset so each page is an index range scan.
+    Pass the smallest id of a page as `before_id` to get the next one.
+    """
+    # Include anything still sitting in the buffer
+    flush()
+
+    clauses = []
+    params = []
+    if event is not None:
+        clauses.append("event = ?")
+        params.append(event)
+    if discord_id is not None:
+        clauses.append("discord_id = ?")
+        params.append(discord_id)
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    c = get_guild_db(guild).cursor()
+    c.execute(
+        f"""
+        SELECT id, created_at, event, discord_id, detail FROM audit_log
+        {where}
+        ORDER BY id DESC
+        LIMIT ?
+    """,
+        (*params, limit),
+    )
+    return c.fetchall()
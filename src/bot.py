@@ -1,8 +1,11 @@
+import asyncio
 import logging
 import os
 import sqlite3
+import tempfile
 import time
 from datetime import datetime
+from typing import Literal
 from zoneinfo import ZoneInfo
 
 import discord
@@ -10,17 +13,35 @@ import logfire
 from discord import app_commands
 from discord.ext import commands
 
+import audit
 import config
+import domains
+import lifecycle
 import logs
-from export import export_db_to_csv, import_csv_to_db
-from otp import generate_otp, match_email, redact_email, send_email_otp, valid_email_domain
+import maintenance
+import monitor
+import stats
+import throttle
+import warmup
+from export import export_db_snapshot, export_db_to_csv, import_csv_to_db, import_snapshot
+from otp import (
+    email_domain,
+    generate_otp,
+    match_email,
+    redact_email,
+    send_email_otp,
+    valid_email_domain,
+)
+from responder import Responder
 from utils import (
     get_commands_hash,
     get_guild_db,
+    get_guild_db_path,
     get_guild_dir,
     get_verified_role,
     log_admin,
     modal_cooldown,
+    replace_guild_db,
     set_verified_role,
 )
 
@@ -40,27 +61,42 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 pending_verifications = {}
 
 
+def forget_expired_verifications(guild_id: int) -> None:
+    now = time.time()
+    for key, record in list(pending_verifications.items()):
+        if key[0] == guild_id and now > record["expires"]:
+            del pending_verifications[key]
+
+
+# Free per-guild state when a guild is hibernated
+lifecycle.on_hibernate.append(forget_expired_verifications)
+lifecycle.on_hibernate.append(audit.forget_guild)
+lifecycle.on_hibernate.append(domains.forget_guild)
+
+
 @bot.tree.error
 async def on_app_command_error(
     interaction: discord.Interaction, error: app_commands.AppCommandError
 ):
     cmd_name = f"/{interaction.command.name}" if interaction.command else "(unknown interaction)"
+    # The command may already have deferred, in which case this sends a followup
+    responder = Responder(interaction, cmd_name)
     if isinstance(error, app_commands.CommandOnCooldown):
         retry_after = int(error.retry_after)
         logging.info(f"Rate limiting {cmd_name} for {interaction.user} for {retry_after} seconds")
-        await interaction.response.send_message(
+        await responder.send(
             f"⏳ This command is on cooldown. Try again in {retry_after} seconds.",
             ephemeral=True,
         )
     elif isinstance(error, app_commands.MissingPermissions):
         logging.info(f"Rejecting command {cmd_name} due to insufficient user permissions")
-        await interaction.response.send_message(
+        await responder.send(
             "❌ You have insufficient permissions to run this command.",
             ephemeral=True,
         )
     else:
         logging.error(f"App command error in {cmd_name}, {interaction}", exc_info=error)
-        await interaction.response.send_message(
+        await responder.send(
             "❌ An error occurred while processing your command.",
             ephemeral=True,
         )
@@ -130,6 +166,7 @@ async def restore_verified_role(member: discord.Member) -> str:
     err = await grant_verified_role(member)
     if err is not None:
         return "🔁 You were already verified but I couldn't restore your role:\n" + err
+    audit.record(guild, audit.ROLE_RESTORED, member)
     return "🔁 You were already verified - I've restored your role."
 
 
@@ -152,25 +189,29 @@ class EmailModal(discord.ui.Modal, title="Email Verification"):
         assert interaction.guild is not None
         assert isinstance(interaction.user, discord.Member)
 
+        responder = Responder(interaction, "EmailModal")
         email = self.email.value.strip().lower()
 
         logging.info(f"{interaction.user} is attempting to verify")
 
         if is_verified(interaction.user):
-            msg = await restore_verified_role(interaction.user)
-            await interaction.response.send_message(msg, ephemeral=True)
+            msg = await responder.run("restore_role", restore_verified_role(interaction.user))
+            await responder.send(msg, ephemeral=True)
             return
 
         if not match_email(email):
-            await interaction.response.send_message("❌ Invalid email format.", ephemeral=True)
+            await responder.send("❌ Invalid email format.", ephemeral=True)
             return
 
-        if not valid_email_domain(email):
-            await interaction.response.send_message(
-                "❌ Email domain not allowed. Allowed domains:"
-                + "".join(f"\n- `@{domain}`" for domain in config.ALLOWED_DOMAINS),
+        policy = domains.get_policy(interaction.guild)
+        if not valid_email_domain(email, policy):
+            await responder.send(
+                f"❌ Email domain not allowed. Allowed domains: {domains.describe(policy.allowed)}",
                 ephemeral=True,
             )
+            audit.record(
+                interaction.guild, audit.DOMAIN_REJECTED, interaction.user, email_domain(email)
+            )
             await log_admin(
                 f"🚫 {interaction.user} tried a non-allowed domain: {redact_email(email)}",
                 interaction.guild,
@@ -185,11 +226,25 @@ class EmailModal(discord.ui.Modal, title="Email Verification"):
         now = time.time()
         if record and now - record["last_sent"] < config.OTP_RESEND_COOLDOWN:
             remaining = int(config.OTP_RESEND_COOLDOWN - (now - record["last_sent"]))
-            await interaction.response.send_message(
+            await responder.send(
                 f"⏳ Wait {remaining}s before requesting another OTP.", ephemeral=True
             )
             return
 
+        # Checked after the per-member limits so that retries don't use up the address's sends
+        throttled = throttle.check_email_send(email)
+        if throttled is not None:
+            limit, retry_after = throttled
+            logging.info(f"Throttled OTP email for {interaction.user} ({limit} limit)")
+            stats.record_event(interaction.guild, stats.OTP_THROTTLED, email)
+            audit.record(interaction.guild, audit.OTP_THROTTLED, interaction.user, limit)
+            if limit == "email":
+                msg = "⏳ Too many codes have been sent to this address."
+            else:
+                msg = "⏳ The bot is sending too many emails right now."
+            await responder.send(f"{msg} Try again in {int(retry_after) + 1}s.", ephemeral=True)
+            return
+
         code = generate_otp()
         key = (interaction.guild.id, user_id)
         pending_verifications[key] = {
@@ -199,11 +254,13 @@ class EmailModal(discord.ui.Modal, title="Email Verification"):
             "email": email,
         }
 
-        resp = send_email_otp(email, code)
+        sent = await responder.run("send_email", asyncio.to_thread(send_email_otp, email, code))
 
-        if resp.status_code == 200:
+        if sent:
             logging.info("OTP successfully sent")
-            await interaction.response.send_message(
+            stats.record_event(interaction.guild, stats.OTP_SENT, email)
+            audit.record(interaction.guild, audit.OTP_SENT, interaction.user, email_domain(email))
+            await responder.send(
                 "📧 OTP sent! Click below to enter it.", view=OTPView(), ephemeral=True
             )
             await log_admin(
@@ -211,10 +268,13 @@ class EmailModal(discord.ui.Modal, title="Email Verification"):
             )
         else:
             # Could be an actual issue but could also just be that an invalid email was entered.
-            # If its an actual issue, then we might have run out of API usage this month.
+            # If its an actual issue, then we might have run out of API usage this month, or
+            # every configured mail transport is down.
             logging.warning(f"OTP failed to send to {interaction.user} in {interaction.guild}")
-            await interaction.response.send_message("❌ Failed to send email.", ephemeral=True)
-            await log_admin(f"❌ Mailgun failed for {interaction.user}", interaction.guild)
+            stats.record_event(interaction.guild, stats.OTP_FAILED, email)
+            audit.record(interaction.guild, audit.OTP_FAILED, interaction.user, email_domain(email))
+            await responder.send("❌ Failed to send email.", ephemeral=True)
+            await log_admin(f"❌ Email failed to send for {interaction.user}", interaction.guild)
 
 
 class OTPModal(discord.ui.Modal, title="Enter pin"):
@@ -230,13 +290,14 @@ class OTPModal(discord.ui.Modal, title="Enter pin"):
         assert interaction.guild is not None
         assert isinstance(interaction.user, discord.Member)
 
+        responder = Responder(interaction, "OTPModal")
         user_id = interaction.user.id
         key = (interaction.guild.id, user_id)
 
         record = pending_verifications.get(key)
 
         if not record:
-            await interaction.response.send_message(
+            await responder.send(
                 "No active verification. Please click the `Verify Email` button again.",
                 ephemeral=True,
             )
@@ -244,13 +305,17 @@ class OTPModal(discord.ui.Modal, title="Enter pin"):
 
         if time.time() > record["expires"]:
             del pending_verifications[key]
+            stats.record_event(interaction.guild, stats.OTP_EXPIRED, record["email"])
+            audit.record(interaction.guild, audit.EXPIRED, interaction.user)
 
-            await interaction.response.send_message("⏰ Code expired.", ephemeral=True)
+            await responder.send("⏰ Code expired.", ephemeral=True)
             await log_admin(f"⌛ OTP expired for {interaction.user}", interaction.guild)
             return
 
         if self.otp.value.lower() != record["code"].lower():
-            await interaction.response.send_message("❌ Incorrect code.", ephemeral=True)
+            stats.record_event(interaction.guild, stats.WRONG_CODE, record["email"])
+            audit.record(interaction.guild, audit.WRONG_CODE, interaction.user)
+            await responder.send("❌ Incorrect code.", ephemeral=True)
             await log_admin(f"❌ Wrong OTP from {interaction.user}", interaction.guild)
             return
 
@@ -265,19 +330,26 @@ class OTPModal(discord.ui.Modal, title="Enter pin"):
                 email=excluded.email,
                 verified=1,
                 verified_at=excluded.verified_at
+            WHERE verified = 0
         """,
             (user_id, record["email"], int(time.time())),
         )
         conn.commit()
+        # Nothing changes when retrying after the role couldn't be granted, so only count once
+        if c.rowcount:
+            stats.record_event(interaction.guild, stats.VERIFIED, record["email"])
+            audit.record(
+                interaction.guild, audit.VERIFIED, interaction.user, email_domain(record["email"])
+            )
 
-        err = await grant_verified_role(interaction.user)
+        err = await responder.run("grant_role", grant_verified_role(interaction.user))
         if err is not None:
-            await interaction.response.send_message(err, ephemeral=True)
+            await responder.send(err, ephemeral=True)
             return
 
         del pending_verifications[key]
 
-        await interaction.response.send_message("✅ Verification successful!", ephemeral=True)
+        await responder.send("✅ Verification successful!", ephemeral=True)
         logging.info(f"verified user {interaction.user}")
         await log_admin(
             f"✅ {interaction.user} verified with {redact_email(record['email'])}",
@@ -288,7 +360,7 @@ class OTPModal(discord.ui.Modal, title="Enter pin"):
 class OTPView(discord.ui.View):
     @discord.ui.button(label="Enter OTP", style=discord.ButtonStyle.primary)
     async def enter_otp(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_modal(OTPModal())
+        await Responder(interaction, "enter_otp").send_modal(OTPModal())
 
 
 class VerifyButtonView(discord.ui.View):
@@ -301,12 +373,14 @@ class VerifyButtonView(discord.ui.View):
     async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         assert isinstance(interaction.user, discord.Member)
 
+        responder = Responder(interaction, "verify_button")
+
         if is_verified(interaction.user):
-            msg = await restore_verified_role(interaction.user)
-            await interaction.response.send_message(msg, ephemeral=True)
+            msg = await responder.run("restore_role", restore_verified_role(interaction.user))
+            await responder.send(msg, ephemeral=True)
             return
 
-        await interaction.response.send_modal(EmailModal())
+        await responder.send_modal(EmailModal())
 
 
 # ---------------- COMMANDS ----------------
@@ -325,21 +399,32 @@ class VerifyButtonView(discord.ui.View):
     config.RATE_LIMIT_EXPORT_SECONDS,
     key=lambda interaction: interaction.guild and interaction.guild.id,
 )
-async def export_db(interaction: discord.Interaction):
+async def export_db(interaction: discord.Interaction, format: Literal["csv", "snapshot"] = "csv"):
     await interaction.response.defer(ephemeral=True)
 
-    exported_csv = export_db_to_csv(get_guild_db(interaction.guild))
+    if format == "snapshot":
+        # The whole database, for restoring with /import on this or another copy of the bot
+        exported = await asyncio.to_thread(
+            export_db_snapshot,
+            get_guild_db_path(interaction.guild),  # type: ignore
+        )
+        extension = "db.gz"
+    else:
+        exported = export_db_to_csv(get_guild_db(interaction.guild))  # type: ignore
+        extension = "csv"
 
     filename = (
         f"verification_backup_{interaction.guild.id}"  # type: ignore
-        f"_{datetime.now(ZoneInfo('Australia/Sydney')).strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+        f"_{datetime.now(ZoneInfo('Australia/Sydney')).strftime('%Y-%m-%d_%H-%M-%S')}"
+        f".{extension}"
     )
 
     logging.info(f"user {interaction.user} is exporting database for guild: {interaction.guild}")
+    audit.record(interaction.guild, audit.EXPORTED, interaction.user, format)  # type: ignore
     await log_admin(f"📤 {interaction.user} exported the verification database.", interaction.guild)
     await interaction.followup.send(
         content="📦 Here is the current verification database:",
-        file=discord.File(exported_csv, filename=filename),
+        file=discord.File(exported, filename=filename),
     )
 
 
@@ -361,7 +446,11 @@ async def export_db(interaction: discord.Interaction):
     config.RATE_LIMIT_IMPORT_SECONDS,
     key=lambda interaction: interaction.guild and interaction.guild.id,
 )
-async def import_db(interaction: discord.Interaction, file: discord.Attachment):
+async def import_db(
+    interaction: discord.Interaction,
+    file: discord.Attachment,
+    format: Literal["csv", "snapshot"] = "csv",
+):
     assert interaction.guild is not None
 
     await interaction.response.defer(ephemeral=True)
@@ -373,8 +462,6 @@ async def import_db(interaction: discord.Interaction, file: discord.Attachment):
         )
         return
 
-    conn = get_guild_db(interaction.guild)
-
     try:
         backup_dir = os.path.join(get_guild_dir(interaction.guild), "backups")
         os.makedirs(backup_dir, exist_ok=True)
@@ -384,7 +471,7 @@ async def import_db(interaction: discord.Interaction, file: discord.Attachment):
         backup_path = os.path.join(backup_dir, backup_filename)
 
         with sqlite3.connect(backup_path) as backup_dest_conn:
-            conn.backup(backup_dest_conn)
+            get_guild_db(interaction.guild).backup(backup_dest_conn)
     except Exception as e:
         logging.error(f"Failed to back up db before importing: {e}")
         await interaction.followup.send(
@@ -394,19 +481,37 @@ async def import_db(interaction: discord.Interaction, file: discord.Attachment):
 
     try:
         file_bytes = await file.read()
-        success, message = import_csv_to_db(conn, file_bytes.decode(errors="backslashreplace"))
+        if format == "snapshot":
+            # Checked and decompressed next to the live database, then swapped in whole
+            # A unique name, so overlapping imports don't write to the same file
+            fd, snapshot_path = tempfile.mkstemp(
+                suffix=".db.tmp", dir=get_guild_dir(interaction.guild)
+            )
+            os.close(fd)
+            success, message = await asyncio.to_thread(import_snapshot, file_bytes, snapshot_path)
+            if success:
+                replace_guild_db(interaction.guild, snapshot_path)
+                # Drop state cached from the old database, such as its domain policy
+                lifecycle.hibernate(interaction.guild.id)
+        else:
+            # Fetched after reading the file, the connection may have been evicted meanwhile
+            success, message = import_csv_to_db(
+                get_guild_db(interaction.guild), file_bytes.decode(errors="backslashreplace")
+            )
         await interaction.followup.send(message)
     except Exception as e:
         logging.error(f"database import failed with error: {e}")
         await interaction.followup.send("❌ Import failed")
     else:
         if success:
+            audit.record(interaction.guild, audit.IMPORTED, interaction.user, message)
             await log_admin(
                 f"📥 {interaction.user} imported a new verification database.",
                 interaction.guild,
             )
             logging.info(f"{interaction.user} replaced database for guild: {interaction.guild}")
         else:
+            audit.record(interaction.guild, audit.IMPORT_FAILED, interaction.user)
             await log_admin(
                 f"❌ Database import requested by {interaction.user} failed.",
                 interaction.guild,
@@ -414,6 +519,98 @@ async def import_db(interaction: discord.Interaction, file: discord.Attachment):
             logging.warning(f"Database import for guild {interaction.guild} failed: {message}")
 
 
+@bot.tree.command(name="stats", description="Show verification statistics for this server")
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.guild_only()
+@logfire.instrument()
+async def stats_cmd(interaction: discord.Interaction):
+    assert interaction.guild is not None
+
+    responder = Responder(interaction, "/stats")
+    guild_stats = stats.get_stats(interaction.guild, days=7)
+    all_time = guild_stats["all_time"]
+    recent = guild_stats["recent"]
+
+    lines = [
+        "📊 **Verification statistics**",
+        f"✅ Verified members: {all_time[stats.VERIFIED]}"
+        f" ({recent[stats.VERIFIED]} this week, {guild_stats['verified_today']} today)",
+        f"📨 OTPs sent this week: {recent[stats.OTP_SENT]} ({all_time[stats.OTP_SENT]} all time)",
+        f"❌ OTPs failed this week: {recent[stats.OTP_FAILED]}"
+        f" ({all_time[stats.OTP_FAILED]} all time)",
+        f"🔢 Wrong codes this week: {recent[stats.WRONG_CODE]}"
+        f" ({all_time[stats.WRONG_CODE]} all time)",
+        f"⌛ OTPs expired this week: {recent[stats.OTP_EXPIRED]}"
+        f" ({all_time[stats.OTP_EXPIRED]} all time)",
+        f"🛑 OTP emails throttled this week: {recent[stats.OTP_THROTTLED]}"
+        f" ({all_time[stats.OTP_THROTTLED]} all time)",
+    ]
+
+    if guild_stats["verified_domains"]:
+        lines.append("Verified members by domain:")
+        lines.extend(
+            f"- `@{domain}`: {count}"
+            for domain, count in guild_stats["verified_domains"].most_common()
+        )
+
+    await responder.send("\n".join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="audit", description="Show the verification audit log, newest first")
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.guild_only()
+@logfire.instrument(extract_args=["event", "before_id"])
+async def audit_cmd(
+    interaction: discord.Interaction,
+    event: Literal[
+        "otp_sent",
+        "otp_failed",
+        "otp_throttled",
+        "domain_rejected",
+        "wrong_code",
+        "expired",
+        "verified",
+        "role_restored",
+        "exported",
+        "imported",
+        "import_failed",
+        "verified_role_set",
+        "domain_policy_set",
+    ]
+    | None = None,
+    member: discord.Member | None = None,
+    before_id: int | None = None,
+):
+    assert interaction.guild is not None
+
+    responder = Responder(interaction, "/audit")
+    entries = audit.query(
+        interaction.guild,
+        event=event,
+        discord_id=member and member.id,
+        before_id=before_id,
+    )
+
+    if not entries:
+        await responder.send("No matching audit log entries.", ephemeral=True)
+        return
+
+    lines = [
+        f"`#{entry_id}` <t:{created_at}:f> **{entry_event}**"
+        + (f" <@{discord_id}>" if discord_id is not None else "")
+        + (f" `{detail}`" if detail is not None else "")
+        for entry_id, created_at, entry_event, discord_id, detail in entries
+    ]
+    if len(entries) == config.AUDIT_PAGE_SIZE:
+        lines.append(f"Older entries: `before_id:{entries[-1][0]}`")
+
+    await responder.send(
+        "\n".join(lines), ephemeral=True, allowed_mentions=discord.AllowedMentions.none()
+    )
+
+
 @bot.tree.command(
     name="send-verify-button",
     description="Send a verification button to this channel",
@@ -462,6 +659,7 @@ async def set_verified_role_cmd(interaction: discord.Interaction, role: discord.
             ephemeral=True,
             allowed_mentions=discord.AllowedMentions(roles=False),
         )
+        audit.record(interaction.guild, audit.VERIFIED_ROLE_SET, interaction.user, str(role.id))
         await log_admin(
             f"🔧 {interaction.user} set verified role to {role.mention}",
             interaction.guild,
@@ -475,6 +673,61 @@ async def set_verified_role_cmd(interaction: discord.Interaction, role: discord.
         )
 
 
+@bot.tree.command(
+    name="domain-policy",
+    description="Show or change which email domains can be used to verify",
+)
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.guild_only()
+@logfire.instrument(extract_args=["allowed", "denied"])
+@app_commands.describe(
+    allowed="Comma-separated domains, e.g. unsw.edu.au,*.unsw.edu.au, or none for the default",
+    denied="Comma-separated domains to refuse, e.g. *.alumni.unsw.edu.au, or none to clear",
+)
+async def domain_policy_cmd(
+    interaction: discord.Interaction, allowed: str | None = None, denied: str | None = None
+):
+    assert interaction.guild is not None
+
+    responder = Responder(interaction, "/domain-policy")
+
+    def parse(text: str | None) -> list[str] | None:
+        if text is None:
+            return None
+        return [] if text.strip().lower() == "none" else domains.parse_rules(text)
+
+    try:
+        new_allowed, new_denied = parse(allowed), parse(denied)
+    except ValueError as e:
+        await responder.send(f"❌ {e}.", ephemeral=True)
+        return
+
+    if new_allowed is None and new_denied is None:
+        policy = domains.get_policy(interaction.guild)
+    else:
+        policy = domains.set_policy(interaction.guild, new_allowed, new_denied)
+        detail = f"allowed={','.join(policy.allowed)}; denied={','.join(policy.denied)}"
+        if len(detail) > audit.MAX_DETAIL_LENGTH:
+            detail = f"{len(policy.allowed)} allowed and {len(policy.denied)} denied rules"
+        audit.record(interaction.guild, audit.DOMAIN_POLICY_SET, interaction.user, detail)
+        await log_admin(
+            f"🌐 {interaction.user} changed the email domain policy. "
+            f"Allowed: {domains.describe(policy.allowed)}. "
+            f"Denied: {domains.describe(policy.denied)}.",
+            interaction.guild,
+        )
+
+    await responder.send(
+        "🌐 **Email domain policy**\n"
+        f"Allowed: {domains.describe(policy.allowed)}\n"
+        f"Denied: {domains.describe(policy.denied)}\n"
+        "The most specific matching rule wins, e.g. allowing `*.unsw.edu.au` and denying "
+        "`alumni.unsw.edu.au` allows every UNSW subdomain except that one.",
+        ephemeral=True,
+    )
+
+
 @bot.tree.command(
     name="check-setup",
     description="Check the configuration of the bot",
@@ -530,9 +783,50 @@ async def check_setup(interaction: discord.Interaction):
     )
 
 
+@bot.tree.command(
+    name="profile",
+    description="Record a sampling profile of the bot (bot owner only)",
+)
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.guild_only()
+@logfire.instrument(extract_args=["seconds"])
+async def profile_cmd(
+    interaction: discord.Interaction,
+    seconds: app_commands.Range[int, 1, config.PROFILE_MAX_SECONDS] = (
+        config.PROFILE_DEFAULT_SECONDS
+    ),
+):
+    # Profiles cover the whole process, not just this guild
+    if not await bot.is_owner(interaction.user):
+        logging.info(f"Rejecting /profile from {interaction.user}, who is not the bot owner")
+        await Responder(interaction, "/profile").send(
+            "❌ Only the bot owner can run this command.", ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    path = await asyncio.to_thread(monitor.sample_profile, seconds)
+    if path is None:
+        await interaction.followup.send("⏳ A profile is already being recorded.", ephemeral=True)
+        return
+
+    await interaction.followup.send(
+        content=f"🔥 Sampled the event loop for {seconds}s (collapsed stack format):",
+        file=discord.File(path),
+        ephemeral=True,
+    )
+
+
 # Runs once on initial startup
 @bot.event
 async def setup_hook():
+    monitor.start()
+    audit.start()
+    maintenance.start()
+    lifecycle.start(bot)
+
     current_hash = get_commands_hash(bot.tree)
     stored_hash = None
     # Using hashes avoids unecessary syncing
@@ -554,11 +848,28 @@ async def setup_hook():
 async def on_ready():
     logging.info(f"Logged in as {bot.user}")
 
-    if not config.MAILGUN_API_KEY:
-        logging.warning("No Mailgun API key provided. OTPs will be logged to the console.")
+    if config.MAIL_TRANSPORTS == ["local"]:
+        logging.warning("No mail transport configured. OTPs will be logged to the console.")
 
     # Register the button view so it keeps working after a restart
     bot.add_view(VerifyButtonView())
 
+    warmup.start(bot)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    logging.info(f"Removed from guild {guild.id}")
+    lifecycle.mark_departed(guild.id)
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    logging.info(f"Joined guild {guild.id}")
+    lifecycle.mark_returned(guild.id)
+
 
 bot.run(config.DISCORD_TOKEN, log_handler=None)
+
+# Write out any audit events still buffered at shutdown
+audit.flush()
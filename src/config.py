@@ -9,6 +9,23 @@ DISCORD_TOKEN = os.environ["DISCORD_TOKEN"]
 MAILGUN_API_KEY = os.environ.get("MAILGUN_API_KEY")
 MAILGUN_DOMAIN = os.environ.get("MAILGUN_DOMAIN")
 MAILGUN_FROM = os.environ.get("MAILGUN_FROM")
+
+# Mail transports to try in order, from mailgun/smtp/local
+# Defaults to Mailgun if it is configured, otherwise OTPs are printed to the console
+MAIL_TRANSPORTS = [
+    t.strip().lower()
+    for t in (
+        os.environ.get("MAIL_TRANSPORTS") or ("mailgun" if MAILGUN_API_KEY else "local")
+    ).split(",")
+]
+SMTP_HOST = os.environ.get("SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SMTP_PORT") or 587)
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_FROM = os.environ.get("SMTP_FROM") or MAILGUN_FROM
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE") or 2)
+# If set, the local transport also writes each email to this directory as a .eml file
+LOCAL_MAIL_DIR = os.environ.get("LOCAL_MAIL_DIR")
 ALLOWED_DOMAINS = [d.strip().lower() for d in os.environ["ALLOWED_EMAIL_DOMAINS"].split(",")]
 
 OTP_EXPIRY_SECONDS = 600
@@ -32,6 +49,8 @@ RATE_LIMIT_EXPORT_SECONDS = int(os.environ.get("RATE_LIMIT_EXPORT_SECONDS", "300
 RATE_LIMIT_IMPORT_TIMES = int(os.environ.get("RATE_LIMIT_IMPORT_TIMES", "10"))
 RATE_LIMIT_IMPORT_SECONDS = int(os.environ.get("RATE_LIMIT_IMPORT_SECONDS", "300"))
 IMPORT_MAX_SIZE_MB = int(os.environ.get("IMPORT_MAX_SIZE_MB", "5"))
+# Snapshots are compressed, this limits their size once decompressed
+IMPORT_MAX_SNAPSHOT_SIZE_MB = int(os.environ.get("IMPORT_MAX_SNAPSHOT_SIZE_MB", "100"))
 
 # OTP attempts
 RATE_LIMIT_OTP_TIMES = int(os.environ.get("RATE_LIMIT_OTP_TIMES", "10"))
@@ -44,3 +63,58 @@ RATE_LIMIT_EMAIL_MEMBER_SECONDS = int(os.environ.get("RATE_LIMIT_EMAIL_MEMBER_SE
 # per-user
 RATE_LIMIT_EMAIL_USER_TIMES = int(os.environ.get("RATE_LIMIT_EMAIL_USER_TIMES", "20"))
 RATE_LIMIT_EMAIL_USER_SECONDS = int(os.environ.get("RATE_LIMIT_EMAIL_USER_SECONDS", "86400"))
+# per-target address, across all users and guilds
+RATE_LIMIT_EMAIL_TARGET_TIMES = int(os.environ.get("RATE_LIMIT_EMAIL_TARGET_TIMES", "5"))
+RATE_LIMIT_EMAIL_TARGET_SECONDS = int(os.environ.get("RATE_LIMIT_EMAIL_TARGET_SECONDS", "3600"))
+RATE_LIMIT_EMAIL_TARGET_MAX_TRACKED = int(
+    os.environ.get("RATE_LIMIT_EMAIL_TARGET_MAX_TRACKED", "20000")
+)
+# global
+RATE_LIMIT_EMAIL_GLOBAL_PER_MINUTE = int(os.environ.get("RATE_LIMIT_EMAIL_GLOBAL_PER_MINUTE", "60"))
+
+# Event loop monitoring
+LOOP_LAG_INTERVAL_MS = int(os.environ.get("LOOP_LAG_INTERVAL_MS", "500"))
+LOOP_LAG_THRESHOLD_MS = int(os.environ.get("LOOP_LAG_THRESHOLD_MS", "250"))
+# /profile
+PROFILE_SAMPLE_INTERVAL_MS = int(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_DEFAULT_SECONDS = int(os.environ.get("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_DIR = LOG_DIR / "profiles"
+
+# Audit log
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "50"))
+AUDIT_FLUSH_MS = int(os.environ.get("AUDIT_FLUSH_MS", "2000"))
+# Noisy events (sent/failed/wrong code/expired) are dropped after AUDIT_COMPACT_DAYS,
+# everything else after AUDIT_RETENTION_DAYS
+AUDIT_COMPACT_DAYS = int(os.environ.get("AUDIT_COMPACT_DAYS", "30"))
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", "365"))
+AUDIT_PAGE_SIZE = 15
+
+# Interactions must be responded to within 3 seconds, defer when work would go past this
+INTERACTION_DEFER_SECONDS = float(os.environ.get("INTERACTION_DEFER_SECONDS", "2"))
+
+# Local OpenMetrics endpoint for Prometheus, disabled unless a port is set
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT") or 0)
+
+# Database maintenance, run during the low-traffic window (Sydney time)
+MAINTENANCE_WINDOW_START_HOUR = int(os.environ.get("MAINTENANCE_WINDOW_START_HOUR", "3"))
+MAINTENANCE_WINDOW_END_HOUR = int(os.environ.get("MAINTENANCE_WINDOW_END_HOUR", "6"))
+MAINTENANCE_INTERVAL_HOURS = int(os.environ.get("MAINTENANCE_INTERVAL_HOURS", "24"))
+MAINTENANCE_BUDGET_SECONDS = int(os.environ.get("MAINTENANCE_BUDGET_SECONDS", "300"))
+MAINTENANCE_JITTER_SECONDS = int(os.environ.get("MAINTENANCE_JITTER_SECONDS", "30"))
+MAINTENANCE_CHECK_SECONDS = 15 * 60
+# Pages freed per incremental vacuum step, writers can get in between steps
+MAINTENANCE_VACUUM_PAGES = 256
+
+# Guild lifecycle
+GUILD_DB_CACHE_SIZE = int(os.environ.get("GUILD_DB_CACHE_SIZE", "16"))
+# Close a guild's database after this long without activity
+GUILD_IDLE_HOURS = int(os.environ.get("GUILD_IDLE_HOURS", "6"))
+# Compress a guild's data this long after the bot is removed from it
+GUILD_ARCHIVE_AFTER_DAYS = int(os.environ.get("GUILD_ARCHIVE_AFTER_DAYS", "30"))
+GUILD_LIFECYCLE_CHECK_SECONDS = 10 * 60
+
+# Warm up the databases of the most recently active guilds when the bot connects, 0 disables
+WARMUP_GUILDS = int(os.environ.get("WARMUP_GUILDS", "0"))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", "4"))
@@ -0,0 +1,163 @@
+import re
+from typing import TYPE_CHECKING
+
+import config
+from utils import get_guild_db
+
+if TYPE_CHECKING:
+    import discord
+
+# Keys in a guild's config table, each holding a comma-separated list of rules
+ALLOWED_KEY = "allowed_domains"
+DENIED_KEY = "denied_domains"
+
+_LABEL = re.compile(r"[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?")
+# Longest domain name DNS allows
+MAX_DOMAIN_LENGTH = 253
+# Longest rule list describe() writes, leaving room for the rest of a Discord message
+MAX_DESCRIBED_LENGTH = 600
+
+
+def parse_rules(text: str) -> list[str]:
+    """Splits a comma-separated list of domain rules, raising ValueError if one is invalid.
+
+    A rule is either a domain such as `unsw.edu.au`, which matches only that domain, or a
+    wildcard such as `*.unsw.edu.au`, which matches any subdomain of it but not the domain itself.
+    """
+    rules = []
+    for part in text.split(","):
+        rule = part.strip().lower().removeprefix("@")
+        if not rule:
+            continue
+        domain = rule.removeprefix("*.")
+        labels = domain.split(".")
+        if (
+            len(domain) > MAX_DOMAIN_LENGTH
+            or len(labels) < 2
+            or not all(_LABEL.fullmatch(label) for label in labels)
+        ):
+            # Cut short so the error still fits in a Discord message
+            if len(rule) > MAX_DOMAIN_LENGTH:
+                rule = rule[:MAX_DOMAIN_LENGTH] + "…"
+            raise ValueError(f"`{rule}` is not a valid domain rule")
+        rules.append(rule)
+    return rules
+
+
+def describe(rules: list[str]) -> str:
+    """Lists rules for a Discord message, e.g. "`@unsw.edu.au`, `@*.unsw.edu.au`".
+
+    Long lists are cut short and end with the number of rules, e.g. "`@a.edu`, … (40 rules)".
+    """
+    if not rules:
+        return "none"
+
+    shown = []
+    length = 0
+    for rule in rules:
+        item = f"`@{rule}`"
+        length += len(item) + 2
+        if length > MAX_DESCRIBED_LENGTH:
+            return ", ".join([*shown, "…"]) + f" ({len(rules)} rules)"
+        shown.append(item)
+    return ", ".join(shown)
+
+
+class _Node:
+    __slots__ = ("children", "exact", "wildcard")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # True to allow, False to deny, None if there is no rule
+        self.exact: bool | None = None
+        self.wildcard: bool | None = None
+
+
+class DomainPolicy:
+    """Allow and deny rules compiled into a trie keyed by domain labels, last label first.
+
+    Checking a domain takes one step per label however many rules there are. The most specific
+    matching rule wins: an exact rule beats a wildcard, and a longer wildcard beats a shorter
+    one. For the same rule, deny beats allow. Domains that match no rule are denied.
+    """
+
+    def __init__(self, allowed: list[str], denied: list[str]):
+        self.allowed = allowed
+        self.denied = denied
+        self._root = _Node()
+        # Denies are added last so they overwrite an identical allow
+        for rules, verdict in ((allowed, True), (denied, False)):
+            for rule in rules:
+                node = self._root
+                for label in reversed(rule.removeprefix("*.").split(".")):
+                    node = node.children.setdefault(label, _Node())
+                if rule.startswith("*."):
+                    node.wildcard = verdict
+                else:
+                    node.exact = verdict
+
+    def allows(self, domain: str) -> bool:
+        verdict = False
+        node = self._root
+        for label in reversed(domain.split(".")):
+            # A wildcard applies to everything below its node
+            if node.wildcard is not None:
+                verdict = node.wildcard
+            node = node.children.get(label)
+            if node is None:
+                return verdict
+        return verdict if node.exact is None else node.exact
+
+
+# Used by guilds that haven't set their own allowed domains
+DEFAULT_POLICY = DomainPolicy(parse_rules(",".join(config.ALLOWED_DOMAINS)), [])
+
+# guild_id -> compiled policy, dropped when the policy changes or the guild hibernates
+_policies: dict[int, DomainPolicy] = {}
+
+
+def get_policy(guild: discord.Guild) -> DomainPolicy:
+    policy = _policies.get(guild.id)
+    if policy is None:
+        c = get_guild_db(guild).cursor()
+        c.execute("SELECT key, value FROM config WHERE key IN (?, ?)", (ALLOWED_KEY, DENIED_KEY))
+        rules = dict(c.fetchall())
+        policy = DomainPolicy(
+            parse_rules(rules.get(ALLOWED_KEY, "")) or DEFAULT_POLICY.allowed,
+            parse_rules(rules.get(DENIED_KEY, "")),
+        )
+        _policies[guild.id] = policy
+    return policy
+
+
+def set_policy(
+    guild: discord.Guild, allowed: list[str] | None, denied: list[str] | None
+) -> DomainPolicy:
+    """Replaces a guild's allowed and/or denied rules, leaving those passed as None unchanged.
+
+    An empty list clears the rules. Without allowed rules, the guild uses DEFAULT_POLICY's.
+    """
+    conn = get_guild_db(guild)
+    with conn:
+        for key, rules in ((ALLOWED_KEY, allowed), (DENIED_KEY, denied)):
+            if rules is None:
+                continue
+            if rules:
+                conn.execute(
+                    """
+                    INSERT INTO config (key, value)
+                    VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value=excluded.value
+                """,
+                    (key, ",".join(rules)),
+                )
+            else:
+                conn.execute("DELETE FROM config WHERE key = ?", (key,))
+
+    forget_guild(guild.id)
+    return get_policy(guild)
+
+
+def forget_guild(guild_id: int) -> None:
+    """Drops a guild's compiled policy, it is rebuilt from the database when next needed."""
+    _policies.pop(guild_id, None)
@@ -1,10 +1,20 @@
 import csv
+import gzip
 import io
 import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
 from typing import Optional
 
 from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
 
+import config
+from stats import rebuild_verified_stats
+from utils import create_tables
+
 
 class UserSchema(BaseModel):
     discord_id: int
@@ -71,6 +81,8 @@ def import_csv_to_db(conn, csv_contents: str) -> tuple[bool, str]:
             """
             cursor.executemany(query, validated_rows)
 
+            rebuild_verified_stats(cursor)
+
         return True, f"Success: Imported {len(validated_rows)} rows."
 
     except Exception as e:
@@ -89,3 +101,120 @@ def export_db_to_csv(conn) -> io.BytesIO:
     writer.writerow(columns)
     writer.writerows(rows)
     return io.BytesIO(out.getvalue().encode())
+
+
+def export_db_snapshot(db_path: str) -> io.BytesIO:
+    """Returns a gzip-compressed copy of a guild database, taken with SQLite's backup API.
+
+    Uses its own connection to the database, so can be run in a worker thread.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        copy_path = os.path.join(tmp_dir, "snapshot.db")
+        source = sqlite3.connect(db_path)
+        copy = sqlite3.connect(copy_path)
+        try:
+            # Consistent even if the bot writes to the database part way through
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+
+        out = io.BytesIO()
+        with open(copy_path, "rb") as f, gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            shutil.copyfileobj(f, gz)
+
+    out.seek(0)
+    return out
+
+
+_PUNCTUATION_SPACE = re.compile(r"\s*([(),])\s*")
+
+
+def _schema(conn: sqlite3.Connection) -> dict[tuple[str, str], str | None]:
+    """Returns each table and index's CREATE statement, ignoring differences in whitespace."""
+    # Skips the statistics tables ANALYZE creates, such as sqlite_stat1, which maintenance writes
+    rows = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'index')"
+        " AND name NOT LIKE 'sqlite\\_stat%' ESCAPE '\\'"
+    ).fetchall()
+    # Indexes SQLite creates for primary keys and unique constraints have no SQL
+    return {
+        (kind, name): sql and _PUNCTUATION_SPACE.sub(r"\1", " ".join(sql.split()))
+        for kind, name, sql in rows
+    }
+
+
+def _check_snapshot(path: str) -> str | None:
+    """Returns why a snapshot can't be imported, or None if it can."""
+    expected = sqlite3.connect(":memory:")
+    conn = sqlite3.connect(path)
+    try:
+        # Stops functions in the untrusted schema, e.g. in a CHECK constraint, from running
+        conn.execute("PRAGMA trusted_schema = OFF")
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check(20)")]
+        if problems != ["ok"]:
+            return "Validation Error: The snapshot failed an integrity check."
+
+        # Triggers and views would run on the bot's own queries
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('trigger', 'view')").fetchone():
+            return "Validation Error: The snapshot contains triggers or views."
+
+        create_tables(expected.cursor())
+        want, got = _schema(expected), _schema(conn)
+        # Tables and indexes added after the snapshot was taken are created when it is opened
+        for name in ("users", "config"):
+            if ("table", name) not in got:
+                return f"Validation Error: The snapshot is missing the `{name}` table."
+        for (kind, name), sql in got.items():
+            if (kind, name) not in want or want[kind, name] != sql:
+                return f"Validation Error: The snapshot's `{name}` {kind} has the wrong schema."
+
+        return None
+    except sqlite3.DatabaseError:
+        return "Validation Error: The file is not a SQLite database."
+    finally:
+        conn.close()
+        expected.close()
+
+
+def import_snapshot(snapshot: bytes, dest_path: str) -> tuple[bool, str]:
+    """Decompresses and checks a snapshot from export_db_snapshot, writing it to dest_path.
+
+    dest_path is only left behind if the snapshot can be imported, the caller then swaps it in
+    with utils.replace_guild_db.
+    """
+    max_size = config.IMPORT_MAX_SNAPSHOT_SIZE_MB * 1024 * 1024
+    success = False
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(snapshot)) as gz, open(dest_path, "wb") as f:
+            size = 0
+            while chunk := gz.read(1024 * 1024):
+                size += len(chunk)
+                if size > max_size:
+                    return False, (
+                        "Validation Error: The uncompressed snapshot is larger than "
+                        f"{config.IMPORT_MAX_SNAPSHOT_SIZE_MB}MB."
+                    )
+                f.write(chunk)
+
+        error = _check_snapshot(dest_path)
+        if error:
+            return False, error
+
+        conn = sqlite3.connect(dest_path)
+        try:
+            (user_count,) = conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        finally:
+            conn.close()
+
+        success = True
+        return True, f"Success: Imported a snapshot with {user_count} users."
+
+    except (OSError, EOFError) as e:
+        # gzip.BadGzipFile is an OSError
+        logging.exception(f"An error occurred during a snapshot import: {e}")
+        return False, "Validation Error: The file is not a gzip-compressed database snapshot."
+
+    finally:
+        if not success and os.path.exists(dest_path):
+            os.remove(dest_path)
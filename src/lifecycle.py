@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import shutil
+import tarfile
+import time
+from typing import TYPE_CHECKING
+
+import logfire
+
+import config
+from utils import ARCHIVE_FILE, close_guild_db, idle_guild_ids, start_background_task
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from discord.ext import commands
+
+# Written to a guild's data directory when the bot leaves it, archived after a grace period
+DEPARTED_FILE = "departed"
+# Files in a guild's data directory that get archived
+ARCHIVED_FILES = ("database.db", "backups")
+
+hibernated_counter = logfire.metric_counter(
+    "guild.hibernated", description="Guild databases closed after being idle"
+)
+archived_counter = logfire.metric_counter(
+    "guild.archived", description="Departed guilds whose data was compressed and archived"
+)
+
+# Called with a guild id when it is hibernated, to drop per-guild state held elsewhere
+on_hibernate: list[Callable[[int], None]] = []
+
+
+def start(bot: commands.Bot) -> None:
+    """Starts hibernating idle guilds and archiving departed ones. Must be called from the loop."""
+    start_background_task("lifecycle", lambda: _lifecycle_loop(bot))
+
+
+async def _lifecycle_loop(bot: commands.Bot):
+    # bot.guilds is only complete once connected
+    await bot.wait_until_ready()
+    while True:
+        try:
+            hibernate_idle()
+        except Exception:
+            logging.exception("Failed to hibernate idle guilds")
+        try:
+            await archive_departed(bot)
+        except Exception:
+            logging.exception("Failed to archive departed guilds")
+        await asyncio.sleep(config.GUILD_LIFECYCLE_CHECK_SECONDS)
+
+
+def hibernate(guild_id: int) -> None:
+    """Frees everything held in memory for a guild. It is reloaded on its next interaction."""
+    close_guild_db(guild_id)
+    for hook in on_hibernate:
+        hook(guild_id)
+
+
+def hibernate_idle() -> None:
+    for guild_id in idle_guild_ids(config.GUILD_IDLE_HOURS * 60 * 60):
+        hibernate(guild_id)
+        hibernated_counter.add(1)
+        logging.info(f"Hibernated idle guild {guild_id}")
+
+
+def _guild_dir(guild_id: int) -> str:
+    return os.path.join(config.DB_DIR, str(guild_id))
+
+
+def mark_departed(guild_id: int) -> None:
+    """Records that the bot left a guild, starting its archive grace period."""
+    hibernate(guild_id)
+
+    guild_dir = _guild_dir(guild_id)
+    marker = os.path.join(guild_dir, DEPARTED_FILE)
+    if os.path.isdir(guild_dir) and not os.path.exists(marker):
+        with open(marker, "w") as f:
+            f.write(str(int(time.time())))
+        logging.info(f"Marked guild {guild_id} as departed")
+
+
+def mark_returned(guild_id: int) -> None:
+    """Cancels a pending archive when the bot rejoins a guild."""
+    marker = os.path.join(_guild_dir(guild_id), DEPARTED_FILE)
+    if os.path.exists(marker):
+        os.remove(marker)
+        logging.info(f"Guild {guild_id} is no longer departed")
+
+
+async def archive_departed(bot: commands.Bot) -> None:
+    """Archives guilds that the bot left more than the grace period ago."""
+    if not os.path.isdir(config.DB_DIR):
+        return
+
+    current_guild_ids = {guild.id for guild in bot.guilds}
+    cutoff = time.time() - config.GUILD_ARCHIVE_AFTER_DAYS * 24 * 60 * 60
+
+    for entry in os.scandir(config.DB_DIR):
+        if not (entry.is_dir() and entry.name.isdigit()):
+            continue
+
+        guild_id = int(entry.name)
+        marker = os.path.join(entry.path, DEPARTED_FILE)
+
+        # Catch up on joins and removals that happened while the bot was offline
+        if guild_id in current_guild_ids:
+            mark_returned(guild_id)
+            continue
+        if not os.path.exists(marker):
+            mark_departed(guild_id)
+            continue
+
+        if os.path.getmtime(marker) < cutoff and os.path.exists(
+            os.path.join(entry.path, "database.db")
+        ):
+            close_guild_db(guild_id)
+            try:
+                await asyncio.to_thread(archive_guild_dir, entry.path)
+            except Exception:
+                # Left as it is and retried next time, the other guilds are still archived
+                logging.exception(f"Failed to archive guild {guild_id}")
+                continue
+            archived_counter.add(1)
+
+
+def archive_guild_dir(guild_dir: str) -> None:
+    """Compresses a guild's database and backups into a single archive, then removes them.
+
+    Opening the guild's database again restores the archive, see utils.get_guild_db.
+    """
+    names = [name for name in ARCHIVED_FILES if os.path.exists(os.path.join(guild_dir, name))]
+    archive_path = os.path.join(guild_dir, ARCHIVE_FILE)
+
+    # Write to a temporary file first so a crash can't leave a partial archive
+    with tarfile.open(archive_path + ".tmp", "w:gz") as archive:
+        for name in names:
+            archive.add(os.path.join(guild_dir, name), arcname=name)
+    os.replace(archive_path + ".tmp", archive_path)
+
+    for name in names:
+        path = os.path.join(guild_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    logging.info(f"Archived data in {guild_dir}")
@@ -7,6 +7,7 @@ import psutil
 from opentelemetry.metrics import CallbackOptions, Observation
 
 import config
+import metrics
 
 
 def init():
@@ -15,6 +16,7 @@ def init():
         service_name="bot",
         environment=config.ENVIRONMENT,
         send_to_logfire="if-token-present",
+        metrics=logfire.MetricsOptions(additional_readers=metrics.readers()),
     )
     logfire_handler = logfire.LogfireLoggingHandler()
 
@@ -37,8 +39,21 @@ def init():
     # More Logfire stuff
     logfire.instrument_system_metrics()
     logfire.metric_gauge_callback("system.disk.utilization", [disk_usage_callback])
+    logfire.metric_gauge_callback("db.files.size", [db_size_callback], unit="By")
+
+    # Local Prometheus endpoint, if enabled
+    metrics.serve()
 
 
 def disk_usage_callback(_options: CallbackOptions):
     usage = psutil.disk_usage("/")
     yield Observation(usage.percent / 100)
+
+
+def db_size_callback(_options: CallbackOptions):
+    total = 0
+    for guild_dir in os.scandir(config.DB_DIR) if os.path.isdir(config.DB_DIR) else ():
+        path = os.path.join(guild_dir.path, "database.db")
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+    yield Observation(total)
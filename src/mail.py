@@ -0,0 +1,244 @@
+import logging
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from email.message import EmailMessage
+
+import logfire
+import requests
+
+import config
+
+mail_sent_counter = logfire.metric_counter(
+    "mail.sent", description="Email send attempts, by transport and result"
+)
+mail_send_histogram = logfire.metric_histogram(
+    "mail.send_duration", unit="ms", description="Time taken by a transport to send an email"
+)
+
+
+@dataclass(frozen=True)
+class Email:
+    to: str
+    subject: str
+    html: str
+    text: str
+
+    def to_message(self, sender: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = sender
+        message["To"] = self.to
+        message["Subject"] = self.subject
+        message.set_content(self.text)
+        message.add_alternative(self.html, subtype="html")
+        return message
+
+
+class MailError(Exception):
+    """Raised by a transport that couldn't send an email.
+
+    A permanent error, such as a rejected recipient, would fail on every transport, so the
+    remaining transports aren't tried.
+    """
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class Transport(ABC):
+    name: str
+
+    @abstractmethod
+    def send(self, email: Email) -> None:
+        """Sends an email, raising MailError on failure. Called from worker threads."""
+
+
+class MailgunTransport(Transport):
+    name = "mailgun"
+
+    def __init__(self, api_key: str, domain: str, sender: str | None):
+        self.url = f"https://api.mailgun.net/v3/{domain}/messages"
+        self.sender = sender
+        # Keeps the HTTPS connection open between sends
+        self.session = requests.Session()
+        self.session.auth = ("api", api_key)
+
+    def send(self, email: Email) -> None:
+        try:
+            resp = self.session.post(
+                self.url,
+                data={
+                    "from": self.sender,
+                    "to": [email.to],
+                    "subject": email.subject,
+                    "html": email.html,
+                    "text": email.text,
+                },
+                timeout=10,
+            )
+        except requests.RequestException as e:
+            raise MailError(f"request failed: {e.__class__.__name__}") from e
+
+        if resp.status_code != 200:
+            # 400 means Mailgun rejected the message itself, e.g. an invalid address.
+            # Anything else (auth, quota, outage) may work on another transport.
+            raise MailError(f"status {resp.status_code}", permanent=resp.status_code == 400)
+
+
+class SMTPTransport(Transport):
+    name = "smtp"
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        username: str | None,
+        password: str | None,
+        sender: str,
+        pool_size: int,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        # Connections are kept open and reused, at most pool_size at once
+        self._idle: queue.LifoQueue[smtplib.SMTP] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=10)
+        try:
+            smtp.starttls(context=ssl.create_default_context())
+            if self.username:
+                smtp.login(self.username, self.password or "")
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def send(self, email: Email) -> None:
+        message = email.to_message(self.sender)
+
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+                pooled = True
+            except queue.Empty:
+                smtp = None
+                pooled = False
+
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                try:
+                    smtp.send_message(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    if not pooled:
+                        raise
+                    # The server closed the idle connection, reconnect once
+                    logging.debug(f"Pooled SMTP connection was closed ({e!r}), reconnecting")
+                    smtp.close()
+                    smtp = self._connect()
+                    smtp.send_message(message)
+            except smtplib.SMTPRecipientsRefused as e:
+                self._idle.put(smtp)  # type: ignore
+                raise MailError("recipient refused", permanent=True) from e
+            except (smtplib.SMTPException, OSError) as e:
+                if smtp is not None:
+                    smtp.close()
+                raise MailError(f"{e.__class__.__name__}") from e
+
+            self._idle.put(smtp)
+
+
+class LocalTransport(Transport):
+    """Stand-in for a real transport for development and testing.
+
+    Prints the email to the console and keeps the most recent emails in `outbox`. If a directory
+    is given, each email is also written there as a .eml file.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        keep: int = 100,
+        sender: str = "Verification Bot <verify@localhost>",
+    ):
+        self.directory = directory
+        self.sender = sender
+        self.outbox: deque[Email] = deque(maxlen=keep)
+
+    def send(self, email: Email) -> None:
+        self.outbox.append(email)
+        print(f"Email to {email.to}: {email.text}")
+        logging.info("Printed email to console")
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{int(time.time())}_{uuid.uuid4().hex}.eml")
+            with open(path, "wb") as f:
+                f.write(email.to_message(self.sender).as_bytes())
+
+
+def _build_transport(name: str) -> Transport:
+    if name == "mailgun":
+        if not (config.MAILGUN_API_KEY and config.MAILGUN_DOMAIN):
+            raise ValueError("The mailgun transport needs MAILGUN_API_KEY and MAILGUN_DOMAIN")
+        return MailgunTransport(config.MAILGUN_API_KEY, config.MAILGUN_DOMAIN, config.MAILGUN_FROM)
+    if name == "smtp":
+        if not (config.SMTP_HOST and config.SMTP_FROM):
+            raise ValueError("The smtp transport needs SMTP_HOST and SMTP_FROM (or MAILGUN_FROM)")
+        return SMTPTransport(
+            config.SMTP_HOST,
+            config.SMTP_PORT,
+            username=config.SMTP_USERNAME,
+            password=config.SMTP_PASSWORD,
+            sender=config.SMTP_FROM,
+            pool_size=config.SMTP_POOL_SIZE,
+        )
+    if name == "local":
+        if config.SMTP_FROM:
+            return LocalTransport(config.LOCAL_MAIL_DIR, sender=config.SMTP_FROM)
+        return LocalTransport(config.LOCAL_MAIL_DIR)
+    raise ValueError(f"Unknown mail transport {name!r}")
+
+
+TRANSPORTS = [_build_transport(name) for name in config.MAIL_TRANSPORTS]
+
+
+def send(email: Email) -> bool:
+    """Sends an email with the first transport that succeeds. Returns whether it was sent.
+
+    Blocks on network IO, so use `asyncio.to_thread` from the event loop.
+    """
+    for transport in TRANSPORTS:
+        start = time.monotonic()
+        try:
+            transport.send(email)
+        except MailError as e:
+            mail_sent_counter.add(1, {"transport": transport.name, "result": "failed"})
+            logging.warning(f"Mail transport {transport.name} failed to send email: {e}")
+            if e.permanent:
+                return False
+            continue
+        finally:
+            mail_send_histogram.record(
+                (time.monotonic() - start) * 1000, {"transport": transport.name}
+            )
+
+        mail_sent_counter.add(1, {"transport": transport.name, "result": "sent"})
+        return True
+
+    return False
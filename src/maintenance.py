@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import logfire
+
+import config
+from utils import start_background_task
+
+MAINTENANCE_TZ = ZoneInfo("Australia/Sydney")
+
+# Touched in a guild's data directory after it has been maintained
+MARKER_FILE = "last_maintenance"
+
+# How long maintenance waits on a lock before skipping a database. Verification writes on the
+# bot's own connections wait up to 5 seconds, so maintenance always gives way to them.
+BUSY_TIMEOUT_SECONDS = 1
+# Pause between incremental vacuum steps, so waiting writers can take the lock
+VACUUM_STEP_PAUSE_SECONDS = 0.05
+
+reclaimed_counter = logfire.metric_counter(
+    "db.maintenance.reclaimed", unit="By", description="Bytes freed by database maintenance"
+)
+corrupt_counter = logfire.metric_counter(
+    "db.maintenance.corrupt", description="Databases that failed an integrity check"
+)
+duration_histogram = logfire.metric_histogram(
+    "db.maintenance.duration", unit="ms", description="Time spent maintaining one database"
+)
+
+
+def start() -> None:
+    """Starts the maintenance scheduler. Must be called from the event loop."""
+    start_background_task("maintenance", _scheduler)
+
+
+async def _scheduler():
+    while True:
+        await asyncio.sleep(
+            config.MAINTENANCE_CHECK_SECONDS + random.uniform(0, config.MAINTENANCE_JITTER_SECONDS)
+        )
+        if _in_window():
+            try:
+                await run_pass()
+            except Exception:
+                logging.exception("Database maintenance pass failed")
+
+
+def _in_window() -> bool:
+    hour = datetime.now(MAINTENANCE_TZ).hour
+    start, end = config.MAINTENANCE_WINDOW_START_HOUR, config.MAINTENANCE_WINDOW_END_HOUR
+    if start <= end:
+        return start <= hour < end
+    # The window wraps around midnight
+    return hour >= start or hour < end
+
+
+def _due_guild_dirs() -> list[str]:
+    """Returns guild directories not maintained within the interval, least recent first."""
+    if not os.path.isdir(config.DB_DIR):
+        return []
+
+    cutoff = time.time() - config.MAINTENANCE_INTERVAL_HOURS * 60 * 60
+    due = []
+    for entry in os.scandir(config.DB_DIR):
+        if not os.path.isfile(os.path.join(entry.path, "database.db")):
+            continue
+        marker = os.path.join(entry.path, MARKER_FILE)
+        last_run = os.path.getmtime(marker) if os.path.exists(marker) else 0
+        if last_run < cutoff:
+            due.append((last_run, entry.path))
+
+    return [path for _, path in sorted(due)]
+
+
+async def run_pass() -> None:
+    """Maintains due guild databases one at a time until they are done or the budget runs out."""
+    deadline = time.monotonic() + config.MAINTENANCE_BUDGET_SECONDS
+    guild_dirs = _due_guild_dirs()
+
+    for i, guild_dir in enumerate(guild_dirs):
+        if time.monotonic() > deadline:
+            logging.info(
+                f"Maintenance budget used up, {len(guild_dirs) - i} databases left for next time"
+            )
+            return
+
+        # Runs in a worker thread with its own connection, so the event loop is never held
+        await asyncio.to_thread(maintain_db, guild_dir, deadline)
+        await asyncio.sleep(random.uniform(0, config.MAINTENANCE_JITTER_SECONDS))
+
+
+def maintain_db(guild_dir: str, deadline: float) -> None:
+    """Checks, analyzes and vacuums a guild database, then marks it as maintained."""
+    path = os.path.join(guild_dir, "database.db")
+    guild_id = os.path.basename(guild_dir)
+    start = time.monotonic()
+    try:
+        size_before = os.path.getsize(path)
+    except FileNotFoundError:
+        # Archived by lifecycle since the pass started, connecting would create an empty database
+        logging.info(f"Skipped maintenance of database for guild {guild_id}: it no longer exists")
+        return
+
+    # Autocommit, so each statement only holds its lock for as long as it runs
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check(20)")]
+        if problems != ["ok"]:
+            corrupt_counter.add(1)
+            logging.error(f"Database for guild {guild_id} failed integrity check: {problems}")
+            # Leave a corrupt database untouched for an admin to look at
+            return
+
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # One-off full vacuum to switch to incremental mode, which is then used from here on
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            while (
+                time.monotonic() < deadline
+                and conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+            ):
+                # Frees pages as the statement is stepped through, so read every row
+                conn.execute(
+                    f"PRAGMA incremental_vacuum({config.MAINTENANCE_VACUUM_PAGES})"
+                ).fetchall()
+                time.sleep(VACUUM_STEP_PAUSE_SECONDS)
+    except sqlite3.OperationalError as e:
+        # Most likely busy, try again on the next pass
+        logging.info(f"Skipped maintenance of database for guild {guild_id}: {e}")
+        return
+    except sqlite3.DatabaseError as e:
+        # Too damaged for the integrity check to run, e.g. "file is not a database"
+        corrupt_counter.add(1)
+        logging.error(f"Database for guild {guild_id} is corrupt: {e}")
+        return
+    finally:
+        conn.close()
+        duration_histogram.record((time.monotonic() - start) * 1000)
+
+    with open(os.path.join(guild_dir, MARKER_FILE), "w"):
+        pass
+
+    reclaimed = max(size_before - os.path.getsize(path), 0)
+    reclaimed_counter.add(reclaimed)
+    logging.info(
+        f"Maintained database for guild {guild_id} in {time.monotonic() - start:.2f}s,"
+        f" reclaimed {reclaimed} bytes"
+    )
@@ -0,0 +1,141 @@
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+
+from opentelemetry.sdk.metrics.export import (
+    ExponentialHistogram,
+    Gauge,
+    Histogram,
+    HistogramDataPoint,
+    InMemoryMetricReader,
+    Sum,
+)
+
+import config
+
+if TYPE_CHECKING:
+    from opentelemetry.sdk.metrics.export import MetricReader
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Registered with Logfire as an extra reader, so it sees every metric whether or not
+# anything is being sent to Logfire. Only collects when scraped.
+_reader = InMemoryMetricReader()
+
+
+def readers() -> list[MetricReader]:
+    """Returns the metric readers to register with Logfire."""
+    return [_reader] if config.METRICS_PORT else []
+
+
+def _name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _labels(attributes, **extra) -> str:
+    labels = {**{_name(k): str(v) for k, v in (attributes or {}).items()}, **extra}
+    if not labels:
+        return ""
+    escaped = (
+        v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped, strict=True)) + "}"
+
+
+def _histogram_lines(name: str, point) -> list[str]:
+    if isinstance(point, HistogramDataPoint):
+        bounds = [*point.explicit_bounds, float("inf")]
+        counts = point.bucket_counts
+    else:
+        # Exponential histogram: bucket i of the positive range covers
+        # (base ** (offset + i), base ** (offset + i + 1)]
+        # Zero and negative values are all put in the first bucket
+        base = 2 ** (2**-point.scale)
+        positive = point.positive
+        bounds = [
+            0.0,
+            *(base ** (positive.offset + i + 1) for i in range(len(positive.bucket_counts))),
+            float("inf"),
+        ]
+        counts = [point.zero_count + sum(point.negative.bucket_counts), *positive.bucket_counts, 0]
+
+    lines = []
+    cumulative = 0
+    for bound, count in zip(bounds, counts, strict=True):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(float(bound))
+        lines.append(f"{name}_bucket{_labels(point.attributes, le=le)} {cumulative}")
+    lines.append(f"{name}_count{_labels(point.attributes)} {point.count}")
+    lines.append(f"{name}_sum{_labels(point.attributes)} {point.sum}")
+    return lines
+
+
+def render() -> str:
+    """Collects all metrics and formats them as OpenMetrics text."""
+    # metric name -> (type, help, sample lines)
+    families: dict[str, tuple[str, str, list[str]]] = {}
+
+    data = _reader.get_metrics_data()
+    for resource_metrics in data.resource_metrics if data else ():
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                name = _name(metric.name)
+                points = metric.data.data_points
+
+                if isinstance(metric.data, Sum) and metric.data.is_monotonic:
+                    kind = "counter"
+                    lines = [f"{name}_total{_labels(p.attributes)} {p.value}" for p in points]
+                elif isinstance(metric.data, Sum | Gauge):
+                    kind = "gauge"
+                    lines = [f"{name}{_labels(p.attributes)} {p.value}" for p in points]
+                elif isinstance(metric.data, Histogram | ExponentialHistogram):
+                    kind = "histogram"
+                    lines = [line for p in points for line in _histogram_lines(name, p)]
+                else:
+                    continue
+
+                family = families.setdefault(name, (kind, metric.description, []))
+                family[2].extend(lines)
+
+    out = []
+    for name, (kind, description, lines) in families.items():
+        out.append(f"# TYPE {name} {kind}")
+        if description:
+            out.append(f"# HELP {name} {description}")
+        out.extend(lines)
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every scrape
+        pass
+
+
+def serve() -> None:
+    """Serves /metrics on config.METRICS_PORT if it is set.
+
+    Runs in its own thread so scrapes never wait on, or hold up, the event loop.
+    """
+    if not config.METRICS_PORT:
+        return
+
+    server = ThreadingHTTPServer((config.METRICS_HOST, config.METRICS_PORT), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
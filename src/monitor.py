@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import logfire
+
+import config
+from utils import start_background_task
+
+if TYPE_CHECKING:
+    from types import FrameType
+
+loop_lag_histogram = logfire.metric_histogram(
+    "asyncio.loop.lag", unit="ms", description="How late the event loop woke up a sleeping task"
+)
+loop_stall_counter = logfire.metric_counter(
+    "asyncio.loop.stalls", description="Times the event loop was blocked past the lag threshold"
+)
+
+# Shared between the event loop and the watchdog/profiler threads
+# loop_thread_id: thread the event loop runs on, whose stack is sampled
+# last_heartbeat: monotonic time of the last heartbeat tick
+_state = {"loop_thread_id": None, "last_heartbeat": time.monotonic()}
+_profile_lock = threading.Lock()
+
+
+def start() -> None:
+    """Starts the loop lag heartbeat and the stall watchdog. Must be called from the event loop."""
+    if not start_background_task("loop-heartbeat", _heartbeat):
+        return
+
+    _state["loop_thread_id"] = threading.get_ident()
+    _state["last_heartbeat"] = time.monotonic()
+
+    threading.Thread(target=_watchdog, name="loop-watchdog", daemon=True).start()
+
+    # `kill -USR1 <pid>` records a profile without needing Discord
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, _on_profile_signal)
+
+    logging.info("Event loop monitor started")
+
+
+async def _heartbeat():
+    interval = config.LOOP_LAG_INTERVAL_MS / 1000
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        _state["last_heartbeat"] = now
+        loop_lag_histogram.record((now - expected) * 1000)
+
+
+def _watchdog():
+    # The heartbeat can't report a stall while the loop is stuck, so this thread checks how long
+    # it has been since the last tick and grabs the loop thread's stack while it is still blocked
+    interval = config.LOOP_LAG_INTERVAL_MS / 1000
+    threshold = config.LOOP_LAG_THRESHOLD_MS / 1000
+    reported = False
+
+    while True:
+        time.sleep(threshold / 2)
+        lag = time.monotonic() - _state["last_heartbeat"] - interval
+
+        if lag <= threshold:
+            reported = False
+            continue
+
+        # Only log each stall once
+        if reported:
+            continue
+        reported = True
+
+        loop_stall_counter.add(1)
+        frame = sys._current_frames().get(_state["loop_thread_id"])  # type: ignore
+        stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)\n"
+        logging.warning(f"Event loop blocked for over {int(lag * 1000)}ms at:\n{stack}")
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_profile(seconds: float) -> str | None:
+    """Samples the event loop thread's stack and writes it in collapsed stack format.
+
+    The output can be opened with flamegraph.pl or speedscope. Blocks the calling thread, so use
+    `asyncio.to_thread` from the event loop.
+
+    Returns the path of the written profile, or None if a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+
+    logging.info(f"Recording a {seconds}s sampling profile")
+
+    samples = Counter()
+    try:
+        interval = config.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(_state["loop_thread_id"])  # type: ignore
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                samples[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    path = os.path.join(config.PROFILE_DIR, f"profile_{timestamp}.folded")
+    with open(path, "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    logging.info(f"Wrote profile with {samples.total()} samples to {path}")
+    return path
+
+
+def _on_profile_signal():
+    threading.Thread(
+        target=sample_profile,
+        args=(config.PROFILE_DEFAULT_SECONDS,),
+        name="profiler",
+        daemon=True,
+    ).start()
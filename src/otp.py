@@ -1,10 +1,13 @@
-import logging
 import re
 import secrets
-
-import requests
+from typing import TYPE_CHECKING
 
 import config
+import mail
+from mail import Email
+
+if TYPE_CHECKING:
+    from domains import DomainPolicy
 
 with open(config.TEMPLATES_DIR / "email_template.html") as f:
     EMAIL_HTML_TEMPLATE = f.read()
@@ -18,12 +21,15 @@ def match_email(email):
     return re.match(r"[^@]+@([^@]+\.[^@]+)", email)
 
 
-def valid_email_domain(email):
+def valid_email_domain(email: str, policy: DomainPolicy) -> bool:
     match = match_email(email)
     if not match:
         return False
-    domain = match.group(1).lower()
-    return domain in config.ALLOWED_DOMAINS
+    return policy.allows(match.group(1).lower())
+
+
+def email_domain(email: str) -> str:
+    return email.rsplit("@", maxsplit=1)[-1].lower()
 
 
 def redact_email(email: str):
@@ -31,28 +37,16 @@ def redact_email(email: str):
     return rf"\*\*\*\*\*@{domain}"
 
 
-def send_email_otp(to_email, code):
-    if not config.MAILGUN_API_KEY:
-        print(f"OTP for {to_email}: {code}")
-        logging.info("Printed OTP to console")
-
-        class MockResponse:
-            status_code = 200
-
-        return MockResponse()
-
-    return requests.post(
-        f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
-        auth=("api", config.MAILGUN_API_KEY),
-        data={
-            "from": config.MAILGUN_FROM,
-            "to": [to_email],
-            "subject": "Verify your email address",
-            "html": EMAIL_HTML_TEMPLATE.replace("{{code}}", code).replace(
+def send_email_otp(to_email, code) -> bool:
+    """Emails a verification code. Returns whether it was sent."""
+    return mail.send(
+        Email(
+            to=to_email,
+            subject="Verify your email address",
+            html=EMAIL_HTML_TEMPLATE.replace("{{code}}", code).replace(
                 "{{expiry_mins}}", str(config.OTP_EXPIRY_SECONDS // 60)
             ),
-            "text": f"Your verification code is: {code}\n"
+            text=f"Your verification code is: {code}\n"
             f"Expires in {config.OTP_EXPIRY_SECONDS // 60} minutes.",
-        },
-        timeout=10,
+        )
     )
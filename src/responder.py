@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+import discord
+import logfire
+
+import config
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable
+
+# Discord's error code for responding to an interaction after its 3 second deadline
+UNKNOWN_INTERACTION = 10062
+
+initial_response_histogram = logfire.metric_histogram(
+    "interaction.initial_response",
+    unit="ms",
+    description="Time from a handler starting to its first response or defer",
+)
+deadline_miss_counter = logfire.metric_counter(
+    "interaction.deadline_misses",
+    description="Interactions that expired before the handler responded",
+)
+
+
+class Responder:
+    """Responds to an interaction while keeping within Discord's initial response deadline.
+
+    Slow work is awaited through `run`, which defers the interaction if the work is still going
+    when `config.INTERACTION_DEFER_SECONDS` is up. `send` then uses the initial response if it is
+    still available and a followup otherwise.
+    """
+
+    def __init__(self, interaction: discord.Interaction, handler: str):
+        self.interaction = interaction
+        self.handler = handler
+        self.started = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    async def run[T](self, operation: str, awaitable: Awaitable[T]) -> T:
+        """Awaits slow work, deferring if it is still running when the budget runs out."""
+        task = asyncio.ensure_future(awaitable)
+        if self.interaction.response.is_done():
+            return await task
+
+        remaining = config.INTERACTION_DEFER_SECONDS - self.elapsed()
+        try:
+            await asyncio.wait((task,), timeout=max(remaining, 0))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        if not task.done():
+            logging.info(f"Deferring {self.handler} after {self.elapsed():.2f}s of {operation}")
+            try:
+                await self._respond(self.interaction.response.defer, ephemeral=True, thinking=True)
+            except discord.HTTPException:
+                # The work has side effects such as granting a role, so let it finish regardless
+                await task
+                raise
+
+        return await task
+
+    async def send(self, content: str | None = None, **kwargs: Any) -> None:
+        if self.interaction.response.is_done():
+            await self.interaction.followup.send(content, **kwargs)  # type: ignore
+        else:
+            await self._respond(self.interaction.response.send_message, content, **kwargs)
+
+    async def send_modal(self, modal: discord.ui.Modal) -> None:
+        # Modals can only be an initial response, so there is nothing to fall back to
+        await self._respond(self.interaction.response.send_modal, modal)
+
+    async def _respond(self, method, *args, **kwargs) -> None:
+        initial_response_histogram.record(self.elapsed() * 1000, {"handler": self.handler})
+        try:
+            await method(*args, **kwargs)
+        except discord.NotFound as e:
+            if e.code == UNKNOWN_INTERACTION:
+                deadline_miss_counter.add(1, {"handler": self.handler})
+                logging.warning(
+                    f"{self.handler} missed the interaction deadline ({self.elapsed():.2f}s)"
+                )
+            raise
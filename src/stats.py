@@ -0,0 +1,110 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo
+
+from otp import email_domain
+from utils import get_guild_db
+
+if TYPE_CHECKING:
+    import sqlite3
+
+    import discord
+
+STATS_TZ = ZoneInfo("Australia/Sydney")
+
+# Events counted in the stats table
+OTP_SENT = "otp_sent"
+OTP_FAILED = "otp_failed"
+OTP_EXPIRED = "otp_expired"
+OTP_THROTTLED = "otp_throttled"
+WRONG_CODE = "wrong_code"
+VERIFIED = "verified"
+
+# '' marks a row holding the all-time total rather than a single day
+ALL_TIME = ""
+
+UPSERT_QUERY = """
+    INSERT INTO stats (day, event, domain, count)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(day, event, domain) DO UPDATE SET count = count + excluded.count
+"""
+
+
+def _day(timestamp: float | None = None) -> str:
+    if timestamp is None:
+        return datetime.now(STATS_TZ).date().isoformat()
+    return datetime.fromtimestamp(timestamp, STATS_TZ).date().isoformat()
+
+
+def record_event(guild: discord.Guild, event: str, email: str) -> None:
+    """Increments today's and the all-time count of `event` for the email's domain."""
+    domain = email_domain(email)
+    conn = get_guild_db(guild)
+    with conn:
+        conn.executemany(
+            UPSERT_QUERY,
+            [(_day(), event, domain, 1), (ALL_TIME, event, domain, 1)],
+        )
+
+
+def rebuild_verified_stats(cursor: sqlite3.Cursor) -> None:
+    """Recomputes the verified counts from the users table, e.g. after it was replaced.
+
+    Runs on the caller's cursor so it can share the transaction that modified users.
+    """
+    cursor.execute("DELETE FROM stats WHERE event = ?", (VERIFIED,))
+
+    counts = Counter()
+    cursor.execute("SELECT email, verified_at FROM users WHERE verified = 1")
+    for email, verified_at in cursor.fetchall():
+        domain = email_domain(email) if email else ""
+        counts[(ALL_TIME, domain)] += 1
+        # Imported members may not have a verification time
+        if verified_at is not None:
+            counts[(_day(verified_at), domain)] += 1
+
+    cursor.executemany(
+        UPSERT_QUERY,
+        [(day, VERIFIED, domain, count) for (day, domain), count in counts.items()],
+    )
+
+
+def get_stats(guild: discord.Guild, days: int = 7) -> dict:
+    """Reads the precomputed counts for a guild.
+
+    Returns a dict with the all-time event totals, the event totals for the last `days` days
+    (including today), today's verified count, and the all-time verified count per domain.
+    """
+    conn = get_guild_db(guild)
+    c = conn.cursor()
+
+    c.execute("SELECT event, domain, count FROM stats WHERE day = ?", (ALL_TIME,))
+    all_time = Counter()
+    verified_domains = Counter()
+    for event, domain, count in c.fetchall():
+        all_time[event] += count
+        if event == VERIFIED:
+            verified_domains[domain] += count
+
+    today = datetime.now(STATS_TZ).date()
+    # ALL_TIME sorts before every date, so it is excluded here
+    since = (today - timedelta(days=days - 1)).isoformat()
+    c.execute(
+        "SELECT event, SUM(count) FROM stats WHERE day >= ? GROUP BY event",
+        (since,),
+    )
+    recent = Counter(dict(c.fetchall()))
+
+    c.execute(
+        "SELECT SUM(count) FROM stats WHERE day = ? AND event = ?",
+        (today.isoformat(), VERIFIED),
+    )
+    verified_today = c.fetchone()[0] or 0
+
+    return {
+        "all_time": all_time,
+        "recent": recent,
+        "verified_today": verified_today,
+        "verified_domains": verified_domains,
+    }
@@ -0,0 +1,104 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+import logfire
+
+import config
+
+throttled_counter = logfire.metric_counter(
+    "mail.throttled", description="OTP emails not sent because a send limit was reached"
+)
+
+
+class SlidingWindowCounter:
+    """Approximate sliding window rate limiter with bounded memory.
+
+    Each key only stores the counts for the current and previous fixed windows. The sliding count
+    is the current count plus the previous count weighted by how much of the previous window is
+    still inside the sliding window. Once `max_keys` keys are tracked, the least recently used
+    key is evicted.
+    """
+
+    def __init__(self, times: int, seconds: float, max_keys: int):
+        self.times = times
+        self.seconds = seconds
+        self.max_keys = max_keys
+        # key -> (start of current window, count in previous window, count in current window)
+        self._windows: OrderedDict[object, tuple[float, int, int]] = OrderedDict()
+
+    def _window(self, key: object, now: float) -> tuple[float, int, int]:
+        window_start = now - now % self.seconds
+        start, previous, current = self._windows.get(key, (window_start, 0, 0))
+
+        if start == window_start:
+            return start, previous, current
+        if start == window_start - self.seconds:
+            return window_start, current, 0
+        return window_start, 0, 0
+
+    def retry_after(self, key: object, now: float | None = None) -> float | None:
+        """Returns how long until `key` can be hit again, or None if it can be hit now."""
+        now = time.time() if now is None else now
+        start, previous, current = self._window(key, now)
+
+        previous_weight = 1 - (now - start) / self.seconds
+        if previous * previous_weight + current < self.times:
+            return None
+
+        if current >= self.times:
+            # Wait for the next window, where this window's count starts to fade out
+            return start + self.seconds - now
+        # Wait for enough of the previous window to slide out
+        needed = 1 - (self.times - current) / previous
+        return max(start + needed * self.seconds - now, 0)
+
+    def hit(self, key: object, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        start, previous, current = self._window(key, now)
+
+        self._windows[key] = (start, previous, current + 1)
+        self._windows.move_to_end(key)
+        while len(self._windows) > self.max_keys:
+            self._windows.popitem(last=False)
+
+
+# Limits sends to a single address, however many Discord accounts are asking
+_per_email = SlidingWindowCounter(
+    config.RATE_LIMIT_EMAIL_TARGET_TIMES,
+    config.RATE_LIMIT_EMAIL_TARGET_SECONDS,
+    config.RATE_LIMIT_EMAIL_TARGET_MAX_TRACKED,
+)
+# Limits sends across all guilds to protect the Mailgun quota
+_global = SlidingWindowCounter(config.RATE_LIMIT_EMAIL_GLOBAL_PER_MINUTE, 60, 1)
+
+
+def email_key(email: str) -> bytes:
+    """Hashes a normalised email, so the throttle doesn't keep addresses in memory."""
+    local, _, domain = email.strip().lower().rpartition("@")
+    # Plus addressing delivers to the same mailbox
+    local = local.split("+", maxsplit=1)[0]
+    return hashlib.blake2b(f"{local}@{domain}".encode(), digest_size=16).digest()
+
+
+def check_email_send(email: str) -> tuple[str, float] | None:
+    """Records an OTP email send to `email` if it is within the send limits.
+
+    Returns None if the email can be sent. Otherwise returns which limit was hit ("email" or
+    "global") and how long until it can be retried.
+    """
+    key = email_key(email)
+
+    retry_after = _per_email.retry_after(key)
+    if retry_after is not None:
+        throttled_counter.add(1, {"limit": "email"})
+        return "email", retry_after
+
+    retry_after = _global.retry_after(None)
+    if retry_after is not None:
+        throttled_counter.add(1, {"limit": "global"})
+        return "global", retry_after
+
+    _per_email.hit(key)
+    _global.hit(None)
+    return None
@@ -1,9 +1,13 @@
+import asyncio
 import hashlib
 import json
 import logging
 import os
 import sqlite3
-from functools import lru_cache, wraps
+import tarfile
+import time
+from collections import OrderedDict
+from functools import wraps
 from typing import TYPE_CHECKING, Any
 
 import discord
@@ -11,12 +15,48 @@ import logfire
 from discord.ext import commands
 
 import config
+from responder import Responder
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Coroutine
 
     from discord.app_commands import CommandTree
 
+db_open_counter = logfire.metric_counter(
+    "db.connections.opened", description="Guild database connections opened"
+)
+
+# Compressed copy of a departed guild's database and backups, see lifecycle.py
+ARCHIVE_FILE = "archive.tar.gz"
+
+# guild_id -> open database connection, least recently used first
+_guild_dbs: OrderedDict[int, sqlite3.Connection] = OrderedDict()
+# guild_id -> monotonic time the guild's database was last used
+_guild_last_used: dict[int, float] = {}
+# guild_id -> verified role id from the guild's config table, or None if it isn't set
+_verified_role_ids: dict[int, int | None] = {}
+# name -> background task, held so the event loop's weak reference isn't the only one
+_background_tasks: dict[str, asyncio.Task] = {}
+
+
+def start_background_task(name: str, factory: Callable[[], Coroutine[Any, Any, None]]) -> bool:
+    """Starts a background task once per process. Must be called from the event loop.
+
+    Returns False without calling `factory` if a task with this name was already started.
+    """
+    if name in _background_tasks:
+        return False
+
+    task = asyncio.get_running_loop().create_task(factory(), name=name)
+    task.add_done_callback(_log_task_exit)
+    _background_tasks[name] = task
+    return True
+
+
+def _log_task_exit(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background task {task.get_name()} crashed", exc_info=task.exception())
+
 
 def get_guild_dir(guild: discord.Guild):
     return os.path.join(config.DB_DIR, str(guild.id))
@@ -35,12 +75,70 @@ def save_guild_info(guild: discord.Guild) -> None:
         f.write(guild.name)
 
 
-@lru_cache(maxsize=16)
-def get_guild_db(guild: discord.Guild):
-    path = get_guild_db_path(guild)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    conn = sqlite3.connect(path)
-    c = conn.cursor()
+def get_guild_db(guild: discord.Guild) -> sqlite3.Connection:
+    """Returns the guild's cached connection, opening it if needed.
+
+    The connection is closed when it is evicted from the cache or the guild hibernates, so callers
+    must not hold it across an await. Call this again after awaiting instead.
+    """
+    conn = _guild_dbs.get(guild.id)
+
+    if conn is None:
+        return cache_guild_db(guild.id, open_guild_db(guild))
+
+    _guild_dbs.move_to_end(guild.id)
+    _guild_last_used[guild.id] = time.monotonic()
+    return conn
+
+
+def cache_guild_db(guild_id: int, conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Adds an opened connection to the cache and returns the cached connection.
+
+    If the guild already has one, e.g. because an interaction opened it first, that one is kept.
+    """
+    cached = _guild_dbs.get(guild_id)
+    if cached is not None:
+        conn.close()
+        return cached
+
+    _guild_dbs[guild_id] = conn
+    _guild_last_used[guild_id] = time.monotonic()
+    while len(_guild_dbs) > config.GUILD_DB_CACHE_SIZE:
+        close_guild_db(next(iter(_guild_dbs)))
+    return conn
+
+
+def close_guild_db(guild_id: int) -> None:
+    """Closes a guild's cached database connection. It is reopened the next time it is used."""
+    _guild_last_used.pop(guild_id, None)
+    _verified_role_ids.pop(guild_id, None)
+    conn = _guild_dbs.pop(guild_id, None)
+    if conn is not None:
+        conn.close()
+
+
+def replace_guild_db(guild: discord.Guild, new_path: str) -> None:
+    """Swaps in a new database file for a guild, which is opened the next time it is used."""
+    close_guild_db(guild.id)
+    os.replace(new_path, get_guild_db_path(guild))
+
+
+def idle_guild_ids(idle_seconds: float) -> list[int]:
+    """Returns the guilds with an open database that hasn't been used for `idle_seconds`."""
+    cutoff = time.monotonic() - idle_seconds
+    return [guild_id for guild_id, last_used in _guild_last_used.items() if last_used < cutoff]
+
+
+def restore_guild_archive(guild_dir: str) -> None:
+    """Unpacks an archived guild's files back into its data directory."""
+    archive_path = os.path.join(guild_dir, ARCHIVE_FILE)
+    with tarfile.open(archive_path, "r:gz") as archive:
+        archive.extractall(guild_dir, filter="data")
+    os.remove(archive_path)
+    logging.info(f"Restored archived data in {guild_dir}")
+
+
+def create_tables(c: sqlite3.Cursor) -> None:
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
             discord_id INTEGER PRIMARY KEY,
@@ -56,7 +154,57 @@ def get_guild_db(guild: discord.Guild):
             value TEXT NOT NULL
         ) STRICT
     """)
+    # Running counts maintained by stats.record_event, so /stats never has to scan users
+    # day is YYYY-MM-DD (Sydney time), or '' for the all-time total
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            day TEXT NOT NULL,
+            event TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, event, domain)
+        ) STRICT
+    """)
+    # Append-only history written in batches by audit.py
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            discord_id INTEGER,
+            detail TEXT
+        ) STRICT
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS audit_log_event ON audit_log (event, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS audit_log_member ON audit_log (discord_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS audit_log_created_at ON audit_log (created_at)")
+
+
+def open_guild_db(guild: discord.Guild) -> sqlite3.Connection:
+    """Opens a guild's database, creating or migrating its tables. Use get_guild_db instead.
+
+    Safe to call from a worker thread, the connection can then be handed to the event loop.
+    """
+    path = get_guild_db_path(guild)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if not os.path.exists(path) and os.path.exists(
+        os.path.join(get_guild_dir(guild), ARCHIVE_FILE)
+    ):
+        restore_guild_archive(get_guild_dir(guild))
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats'")
+    stats_existed = c.fetchone() is not None
+    create_tables(c)
+    if not stats_existed:
+        # Backfill verified counts for databases created before the stats table existed
+        from stats import rebuild_verified_stats
+
+        rebuild_verified_stats(c)
     conn.commit()
+    db_open_counter.add(1)
     logging.info(f"loaded or created database for guild {guild.id}")
 
     save_guild_info(guild)
@@ -64,16 +212,28 @@ def get_guild_db(guild: discord.Guild):
     return conn
 
 
-def get_verified_role(guild: discord.Guild) -> discord.Role | None:
-    conn = get_guild_db(guild)
+def read_verified_role_id(conn: sqlite3.Connection) -> int | None:
     c = conn.cursor()
     c.execute("SELECT value FROM config WHERE key = 'verified_role_id'")
     row = c.fetchone()
+    return None if row is None else int(row[0])
+
+
+def cache_verified_role_id(guild_id: int, role_id: int | None) -> None:
+    # Doesn't overwrite, in case the role was set since role_id was read
+    _verified_role_ids.setdefault(guild_id, role_id)
+
+
+def get_verified_role(guild: discord.Guild) -> discord.Role | None:
+    conn = get_guild_db(guild)
+
+    if guild.id not in _verified_role_ids:
+        _verified_role_ids[guild.id] = read_verified_role_id(conn)
 
-    if row is None:
+    role_id = _verified_role_ids[guild.id]
+    if role_id is None:
         return None
 
-    role_id = int(row[0])
     return guild.get_role(role_id)
 
 
@@ -89,6 +249,7 @@ def set_verified_role(guild: discord.Guild, role: discord.Role) -> None:
         (str(role.id),),
     )
     conn.commit()
+    _verified_role_ids[guild.id] = role.id
 
 
 async def log_admin(message, guild, **kwargs):
@@ -146,7 +307,7 @@ def modal_cooldown(times: int, seconds: float, key: Callable[[discord.Interactio
 
             if retry_after is not None:
                 logging.info(f"Rate limiting {interaction.user} for {retry_after} seconds")
-                await interaction.response.send_message(
+                await Responder(interaction, func.__qualname__).send(
                     f"⏳ Too many requests. Try again in {int(retry_after)}s.",
                     ephemeral=True,
                 )
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import TYPE_CHECKING
+
+import logfire
+
+import config
+from utils import (
+    cache_guild_db,
+    cache_verified_role_id,
+    get_guild_db_path,
+    open_guild_db,
+    read_verified_role_id,
+    start_background_task,
+)
+
+if TYPE_CHECKING:
+    import discord
+    from discord.ext import commands
+
+guild_warmup_histogram = logfire.metric_histogram(
+    "guild.warmup.duration", unit="ms", description="Time taken to warm up one guild"
+)
+warmup_histogram = logfire.metric_histogram(
+    "warmup.duration", unit="ms", description="Time taken to warm up all guilds after connecting"
+)
+
+
+def start(bot: commands.Bot) -> None:
+    """Warms up the most active guilds in the background, once per process.
+
+    Does nothing unless config.WARMUP_GUILDS is set. Must be called from the event loop.
+    """
+    if config.WARMUP_GUILDS:
+        start_background_task("warmup", lambda: warm_up(bot))
+
+
+def _last_active(path: str) -> float:
+    """Returns when a guild's database last recorded an audit event, or 0 if it never has."""
+    # Maintenance rewrites every database, so the file's mtime says nothing about activity.
+    # MAX over the created_at index only reads the last entry, and read-only skips the schema DDL.
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return 0
+    try:
+        (last_event,) = conn.execute("SELECT MAX(created_at) FROM audit_log").fetchone()
+    except sqlite3.Error:
+        # Databases that haven't been opened since the audit log was added don't have it yet
+        return 0
+    finally:
+        conn.close()
+    return last_event or 0
+
+
+def _most_active(guilds: list[discord.Guild], limit: int) -> list[discord.Guild]:
+    # Guilds without a database have never been used and aren't worth warming
+    last_active = {}
+    for guild in guilds:
+        path = get_guild_db_path(guild)
+        if os.path.exists(path):
+            last_active[guild.id] = _last_active(path)
+
+    ranked = sorted(
+        (guild for guild in guilds if guild.id in last_active),
+        key=lambda guild: last_active[guild.id],
+        reverse=True,
+    )
+    return ranked[:limit]
+
+
+def _load(guild: discord.Guild) -> tuple[sqlite3.Connection, int | None]:
+    conn = open_guild_db(guild)
+    # Read through users so its pages are in the connection's cache for is_verified lookups
+    for _ in conn.execute("SELECT discord_id, verified FROM users"):
+        pass
+    return conn, read_verified_role_id(conn)
+
+
+async def _warm_guild(guild: discord.Guild, slots: asyncio.Semaphore) -> None:
+    async with slots:
+        start = time.monotonic()
+        try:
+            # Opening runs the schema DDL and writes guild_name.txt, keep it off the event loop
+            conn, role_id = await asyncio.to_thread(_load, guild)
+        except Exception:
+            logging.exception(f"Failed to warm up guild {guild.id}")
+            return
+
+        cache_guild_db(guild.id, conn)
+        cache_verified_role_id(guild.id, role_id)
+        guild_warmup_histogram.record((time.monotonic() - start) * 1000)
+
+
+async def warm_up(bot: commands.Bot) -> None:
+    """Opens the databases of the most recently active guilds, a few at a time."""
+    start = time.monotonic()
+    # Opens every guild's database to rank them, keep it off the event loop
+    guilds = await asyncio.to_thread(
+        _most_active, bot.guilds, min(config.WARMUP_GUILDS, config.GUILD_DB_CACHE_SIZE)
+    )
+    slots = asyncio.Semaphore(config.WARMUP_CONCURRENCY)
+
+    await asyncio.gather(*(_warm_guild(guild, slots) for guild in guilds))
+
+    duration = time.monotonic() - start
+    warmup_histogram.record(duration * 1000)
+    logging.info(f"Warmed up {len(guilds)} guilds in {duration:.2f}s")